@@ -1,12 +1,14 @@
 import logging
+import os
 
-from dynaconf import settings
-from peewee import SqliteDatabase
+from barcounter import startup
+
+# only the yaml settings and secrets are used (and their .local files), don't let dynaconf probe every other format
+os.environ.setdefault("SETTINGS_FILE_FOR_DYNACONF", "settings.yaml,.secrets.yaml")
 
-db = SqliteDatabase(settings["DB_LOCATION"], autoconnect=True,
-                    autocommit=True)
+from dynaconf import settings
 
-from barcounter.cogs import *
-from . import bot
+from barcounter.database import create_database
 
+db = create_database(settings)
 log = logging.getLogger('barcounter')
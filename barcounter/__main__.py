@@ -1,6 +1,10 @@
-from . import bot, dbentities, db
+from . import db, launcher, migrations, startup
 
-with db:
-    db.create_tables([dbentities.Drink, dbentities.Person, dbentities.Server])
+# the spawned workers import this module too
+if __name__ == "__main__":
+    startup.phase("imports")
+    with db.connection_context():
+        migrations.migrate()
+    startup.phase("schema")
 
-bot.start()
+    launcher.launch()
@@ -7,19 +7,25 @@ from logging.handlers import RotatingFileHandler
 from discord.ext import commands
 from dynaconf import settings
 
+from barcounter import db, httpclient, metrics, startup
+from barcounter.dbexecutor import dbx
+from barcounter.outbox import outbox
+from barcounter.state import engine
 
-def setup_logger():
+
+def setup_logger(suffix=""):
     logger = logging.getLogger('discord')
     logger.setLevel(logging.INFO)
-    handler = RotatingFileHandler(filename=os.path.join(settings["LOGS_LOCATION"], 'discord.log'), encoding='utf-8',
-                                  mode='w', maxBytes=8 * 1024 * 1024)
+    handler = RotatingFileHandler(filename=os.path.join(settings["LOGS_LOCATION"], 'discord{0}.log'.format(suffix)),
+                                  encoding='utf-8', mode='w', maxBytes=8 * 1024 * 1024)
     handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
     logger.addHandler(handler)
 
     logger = logging.getLogger('barcounter')
     logger.setLevel(logging.INFO)
-    handler1 = RotatingFileHandler(filename=os.path.join(settings["LOGS_LOCATION"], 'barcounter.log'), encoding='utf-8',
-                                   mode='w', maxBytes=8 * 1024 * 1024)
+    handler1 = RotatingFileHandler(filename=os.path.join(settings["LOGS_LOCATION"],
+                                                         'barcounter{0}.log'.format(suffix)),
+                                   encoding='utf-8', mode='w', maxBytes=8 * 1024 * 1024)
     handler1.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
     handler2 = logging.StreamHandler(stream=sys.stdout)
     handler2.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
@@ -27,19 +33,36 @@ def setup_logger():
     logger.addHandler(handler2)
 
 
-def start():
-    setup_logger()
+def start(shard_ids=None, shard_count=None, worker=None):
+    """
+    Runs the bot until it's logged out. With shard_count, runs the shard_ids shards in one AutoShardedBot.
+    """
+    setup_logger("" if worker is None else "-worker-{0}".format(worker))
     token = settings.TOKEN
-    bot = commands.Bot(command_prefix=settings.COMMAND_PREFIX)
+    if shard_count is None:
+        bot = commands.Bot(command_prefix=settings.COMMAND_PREFIX)
+    else:
+        bot = commands.AutoShardedBot(command_prefix=settings.COMMAND_PREFIX, shard_ids=shard_ids,
+                                      shard_count=shard_count)
     bot.load_extension("barcounter.cogs.drinkcog")
     bot.load_extension("barcounter.cogs.roleregistrarcog")
     bot.load_extension("barcounter.cogs.settingscog")
-    logging.getLogger('barcounter').info("Connecting...")
+    startup.phase("extensions")
+    if shard_count is None:
+        logging.getLogger('barcounter').info("Connecting...")
+    else:
+        logging.getLogger('barcounter').info("Connecting shards {0} of {1}...".format(shard_ids, shard_count))
     loop = asyncio.get_event_loop()
+    loop.run_until_complete(metrics.start(bot, db, worker))
     try:
         loop.run_until_complete(bot.start(token))
     except KeyboardInterrupt:
         loop.run_until_complete(bot.logout())
         # cancel all tasks lingering
     finally:
+        loop.run_until_complete(outbox.flush())
+        loop.run_until_complete(engine.stop())
+        loop.run_until_complete(metrics.stop())
+        loop.run_until_complete(httpclient.close())
+        dbx.shutdown()
         loop.close()
@@ -1,13 +1,22 @@
 import asyncio
+import time
+from typing import List
 
-import aiocron as aiocron
-from discord import Member, Forbidden
+from discord import Member, Forbidden, HTTPException, RawReactionActionEvent, TextChannel
 from discord.ext import commands
 from discord.ext.commands import Bot
+from dynaconf import settings
 
+from barcounter import pages, sharding, startup
 from barcounter.cogs.helpers import *
+from barcounter.cogs.roleregistrarcog import barman_only, ROLE_NAME
 from barcounter.dbentities import Drink, Person, DoesNotExist
-from barcounter.jokesimporter import get_joke
+from barcounter.dbexecutor import dbx
+from barcounter.jokesimporter import get_joke, prefill
+from barcounter.outbox import outbox
+from barcounter.pages import page_registry, PageSession, PREV_EMOJI, NEXT_EMOJI
+from barcounter.serveregistry import registry, ServeEntry, EXPIRED
+from barcounter.state import engine
 
 logger = log
 
@@ -18,69 +27,148 @@ PORTION_MAX_SIZE = conf.limitation("portion_max_size")
 DEFAULT_INTOXICATION = 20
 DEFAULT_PORTION_SIZE = 100
 DEFAULT_PORTIONS_PER_DAY = 10
+SERVE_COALESCE_WINDOW = settings.SERVE["coalesce_window"]
+SERVE_PERSIST = settings.SERVE["persist"]
 
 
-async def consume_drink(ctx: Context, person: Person, drink: Drink, member: Member):
-    if person.intoxication > 100 or person.intoxication < 0:
-        person.intoxication = 0
-    guild: Guild = ctx.guild
-    # member: Member = guild.get_member(person.uid)
-    lang = get_lang_from_context(ctx)
-
-    if drink.portions_left <= 0:
-        await ctx.send(conf.lang(lang, "no_portions_left").format(drink.name))
-    else:
-        if drink.portions_left == 1:
-            await ctx.send(conf.lang(lang, "last_portion").format(drink.name))
-        person.intoxication += drink.intoxication
-        drink.portions_left -= 1
-        if person.intoxication >= 100:
-            try:
-                await member.move_to(None, reason="Drank too much")
-                await ctx.send(conf.lang(lang, "overdrink_kick_message").format(member.mention))
-            except Forbidden:
-                log.info("Can't kick an alcoholic: no permissions in " + guild.id)
-                await ctx.send(conf.lang(lang, "overdrink_no_kick_message").format(member.mention))
-            finally:
-                person.intoxication = 0
-        elif person.intoxication > 80:
-            await ctx.send(conf.lang(lang, "pre_overdrink").format(member.display_name))
-        log.info("{0} consumed drink \"{1}\" on {2}".format(member.display_name, drink.name, guild.id))
-    with db.atomic():
-        person.save()
-        drink.save()
+async def take_portion(person: Person, drink: Drink, now: int) -> Optional[int]:
+    """
+    Gives one portion of the drink to the person, if the database still has one.
 
+    :return: intoxication of the person after the drink (before the overdrink reset) or None if the drink ran out
+    """
+    if not await engine.take_portions(drink):
+        return None
+    return give_portion(person, drink, now)
 
-def check_guild_drink_count(gid: int):
-    return Drink.select(Drink).join(Server).where(Server.sid == gid).count() < DRINKS_PER_SERVER
 
+def give_portion(person: Person, drink: Drink, now: int) -> int:
+    """
+    Gives a portion already taken from the drink to the person.
 
-@aiocron.crontab("0 0 * * *")
-async def restock():
-    (Drink.update(portions_left=Drink.portions_per_day)).execute()
-    log.info("Restocked every server")
+    :return: intoxication of the person after the drink (before the overdrink reset)
+    """
+    intoxication = person.current_intoxication(now)
+    if intoxication > 100:
+        intoxication = 0
+    pages.invalidate(drink.server_id)
+    intoxication += drink.intoxication
+    person.set_intoxication(intoxication if intoxication < 100 else 0, now)
+    engine.record_dose(person, drink, now)
+    return intoxication
+
+
+async def overdrink_message(lang: str, member: Member, intoxication: int) -> Optional[str]:
+    if intoxication >= 100:
+        try:
+            await member.move_to(None, reason="Drank too much")
+            return conf.lang(lang, "overdrink_kick_message").format(member.mention)
+        except Forbidden:
+            log.info("Can't kick an alcoholic: no permissions in {0}".format(member.guild.id))
+            return conf.lang(lang, "overdrink_no_kick_message").format(member.mention)
+    elif intoxication > 80:
+        return conf.lang(lang, "pre_overdrink").format(member.display_name)
+    return None
 
 
-@aiocron.crontab("* * * * *")
-async def deintoxication():
-    delta = 1
-    (Person.update(intoxication=Person.intoxication - delta).where(Person.intoxication >= delta)).execute()
-    (Person.update(intoxication=0).where(Person.intoxication < delta)).execute()
+async def consume_drink(ctx: Context, person: Person, drink: Drink, member: Member):
+    guild: Guild = ctx.guild
+    lang = await get_lang_from_context(ctx)
+    intoxication = await take_portion(person, drink, int(time.time()))
+    if intoxication is None:
+        outbox.post(ctx.channel, conf.lang(lang, "no_portions_left").format(drink.name))
+        return
+    if drink.portions_left == 0:
+        outbox.post(ctx.channel, conf.lang(lang, "last_portion").format(drink.name))
+    message = await overdrink_message(lang, member, intoxication)
+    if message is not None:
+        outbox.post(ctx.channel, message)
+    log.info("{0} consumed drink \"{1}\" on {2}".format(member.display_name, drink.name, guild.id))
+
+
+async def serve_drinks(channel: TextChannel, guild: Guild, members: List[Member], drink_name: str):
+    """
+    Gives the drink to every accepted member at once and answers with a single message.
+    The portions are taken at once, the members are served in order while they last.
+    """
+    server = await get_server_or_create(guild.id, guild.preferred_locale)
+    lang = server.lang
+    try:
+        drink = await engine.get_drink(server, drink_name)
+    except DoesNotExist:
+        outbox.post(channel, conf.lang(lang, "drink_not_found").format(drink_name))
+        return
+    persons = await engine.get_persons(server, [member.id for member in members])
+    granted = await engine.take_portions(drink, len(members))
+    now = int(time.time())
+    served = [(member, give_portion(person, drink, now)) for member, person in zip(members[:granted], persons)]
+
+    lines = []
+    if served:
+        lines.append(conf.lang(lang, "served").format(", ".join(member.mention for member, _ in served), drink.name))
+        if drink.portions_left == 0:
+            lines.append(conf.lang(lang, "last_portion").format(drink.name))
+    if len(served) < len(members):
+        lines.append(conf.lang(lang, "no_portions_left").format(drink.name))
+    for member, intoxication in served:
+        message = await overdrink_message(lang, member, intoxication)
+        if message is not None:
+            lines.append(message)
+    if served:
+        lines.append(get_joke(lang) or conf.lang(lang, "joke_not_loaded"))
+    for line in lines:
+        outbox.post(channel, line)
+    log.info("Served drink \"{0}\" to {1} members on {2}".format(drink.name, len(served), guild.id))
+
+
+async def run_serve(entry: ServeEntry, channel: TextChannel, guild: Guild):
+    """
+    Consumes the answers to the serve until everyone answered or it expired.
+    The serve is unregistered however it ends.
+    """
+    loop = asyncio.get_event_loop()
+    expired = False
+    try:
+        while not expired and (entry.expected or not entry.queue.empty()):
+            answer = await entry.queue.get()
+            if answer is EXPIRED:
+                break
+            answers = [answer]
+            window_end = loop.time() + SERVE_COALESCE_WINDOW
+            # after the first accept, collect the others for a short window and serve them together
+            while answers[0][1] and (entry.expected or not entry.queue.empty()):
+                try:
+                    answer = await asyncio.wait_for(entry.queue.get(), max(0.0, window_end - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+                if answer is EXPIRED:
+                    expired = True
+                    break
+                answers.append(answer)
+            accepted = [guild.get_member(uid) for uid, ok in answers if ok]
+            accepted = [member for member in accepted if member is not None]
+            if accepted:
+                await serve_drinks(channel, guild, accepted, entry.drink_name)
+    finally:
+        await registry.unregister(entry.message_id)
+
+
+async def check_guild_drink_count(server: Server):
+    return await dbx.read(Drink.select().where(Drink.server == server).count) < DRINKS_PER_SERVER
 
 
 async def give_a_drink(ctx, member, drink):
-    lang = get_lang_from_context(ctx)
-    person = get_person_or_create(ctx.guild.id, member.id, ctx.guild.preferred_locale)
+    lang = await get_lang_from_context(ctx)
+    person = await get_person_or_create(ctx.guild.id, member.id, ctx.guild.preferred_locale)
     await consume_drink(ctx, person, drink, member)
-    async with ctx.typing():
-        joke = get_joke(lang)
-    await ctx.send(joke or conf.lang(lang, "joke_not_loaded"))
+    joke = get_joke(lang)
+    outbox.post(ctx.channel, joke or conf.lang(lang, "joke_not_loaded"))
 
 
 def not_barman(coro):
     async def process(self, ctx, error):
-        if isinstance(error, commands.MissingRole) and error.missing_role == "barman":
-            await ctx.send(get_lang_from_context(ctx), "missing_role")
+        if isinstance(error, commands.MissingRole) and error.missing_role == ROLE_NAME:
+            await ctx.send(conf.lang(await get_lang_from_context(ctx), "missing_role"))
         else:
             await coro(self, ctx, error)
 
@@ -94,16 +182,82 @@ class DrinkCog(commands.Cog):
 
     def __init__(self, bot):
         self.bot: Bot = bot
+        self._serves_restored = False
+        self._reconciled = False
+        engine.start(bot.loop)
+        registry.start(bot.loop)
+        page_registry.start(bot.loop)
+
+    def cog_unload(self):
+        registry.stop()
+        page_registry.stop()
+        asyncio.ensure_future(engine.stop())
 
     @commands.Cog.listener()
     async def on_ready(self):
+        prefill()
+        if not self._reconciled:
+            self._reconciled = True
+            await reconcile_servers(self.bot.guilds)
+        if SERVE_PERSIST and not self._serves_restored:
+            self._serves_restored = True
+            await self.restore_serves()
         log.info("Successfully connected and ready")
+        startup.report()
+
+    async def restore_serves(self):
+        """
+        Resumes the serves of the owned guilds persisted before the restart, the expired ones are cleaned up.
+        """
+        for row in await registry.load_persisted():
+            if not sharding.owns(row.guild_id):
+                continue
+            guild = self.bot.get_guild(row.guild_id)
+            if guild is None:
+                continue
+            channel = guild.get_channel(row.channel_id)
+            expected = [int(uid) for uid in row.expected.split()]
+            remaining = row.deadline - time.time()
+            if channel is None or not expected or remaining <= 0:
+                await dbx.write(row.delete_instance)
+                if channel is not None:
+                    self.bot.loop.create_task(self._delete_serve_message(channel, row.message_id))
+                continue
+            lang = await get_lang_from_guild(guild)
+            entry = ServeEntry(row.message_id, row.channel_id, row.guild_id, row.author_id, row.drink_name,
+                               expected, conf.lang(lang, "ok-emoji"), conf.lang(lang, "no-emoji"))
+            await registry.register(entry, remaining)
+            self.bot.loop.create_task(self._resume_serve(entry, channel, guild))
+        log.info("Restored pending serves")
+
+    async def _resume_serve(self, entry: ServeEntry, channel: TextChannel, guild: Guild):
+        try:
+            await run_serve(entry, channel, guild)
+        finally:
+            await self._delete_serve_message(channel, entry.message_id)
+
+    @staticmethod
+    async def _delete_serve_message(channel: TextChannel, message_id: int, message=None):
+        try:
+            if message is None:
+                message = await channel.fetch_message(message_id)
+            await message.delete()
+        except HTTPException:
+            log.info("Serve message {0} on {1} is already gone".format(message_id, channel.guild.id))
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload: RawReactionActionEvent):
+        if self.bot.user is not None and payload.user_id == self.bot.user.id:
+            return
+        emoji = str(payload.emoji)
+        if not registry.dispatch(payload.message_id, payload.user_id, emoji):
+            page_registry.dispatch(payload.message_id, payload.user_id, emoji)
 
     @commands.Cog.listener()
     async def on_guild_join(self, guild: Guild):
         log.info("Joined guild {0}".format(guild.id))
         await add_default_drinks(guild)
-        server = get_server_or_create(guild.id, guild.preferred_locale)
+        server = await get_server_or_create(guild.id, guild.preferred_locale)
         if guild.system_channel is not None:
             await guild.system_channel.send(
                 conf.lang(server.lang, "greetings").format(self.bot.user.name, self.bot.command_prefix,
@@ -114,31 +268,32 @@ class DrinkCog(commands.Cog):
     @commands.Cog.listener()
     async def on_guild_remove(self, guild):
         log.info("Removing guild {0}".format(guild.id))
-        server = get_server_or_create(guild.id, guild.preferred_locale)
-        with db.atomic():
-            Drink.delete().where(Drink.server == server).execute()
-            Person.delete().where(Person.server == server).execute()
-            server.delete_instance()
+        server = await get_server_or_create(guild.id, guild.preferred_locale)
+        engine.evict_server(server)
+        invalidate_server(guild.id)
+        await dbx.write(delete_servers, [server])
+        pages.invalidate(server.id)
         return True
 
     @commands.command()
     @commands.guild_only()
     async def list(self, ctx: Context):
         """
-        Returns the list with available drinks
+        Returns the list with available drinks, long lists are paged with the reactions
         """
-        server = get_server_from_context(ctx)
+        server = await get_server_from_context(ctx)
         lang = server.lang
-        drinks = Drink.select().where(Drink.server == server)
-        out = "\n".join([
-            conf.lang(lang, "drink_info").format(drink.name, drink.portion_size, drink.portions_left,
-                                                 drink.portions_per_day)
-            for drink in drinks
-        ])
-        if out != "":
-            await ctx.send(out)
-        else:
+        await engine.restock_due_drinks(server)
+        text, next_after = await pages.get_page(server)
+        if text == "":
             await ctx.send(conf.lang(lang, "no_drinks"))
+        elif next_after is None:
+            await ctx.send(text)
+        else:
+            msg = await ctx.send(pages.with_footer(lang, text, 0))
+            page_registry.register(PageSession(msg, ctx.guild, ["", next_after]))
+            await msg.add_reaction(PREV_EMOJI)
+            await msg.add_reaction(NEXT_EMOJI)
 
     @commands.command()
     @commands.guild_only()
@@ -150,13 +305,13 @@ class DrinkCog(commands.Cog):
         Parameters:
         drink_name: name of the drink, not empty
         """
-        server = get_server_from_context(ctx)
+        server = await get_server_from_context(ctx)
         lang = server.lang
         if drink_name is None or len(drink_name) > DRINK_NAME_LENGTH:
             await ctx.send(conf.lang(lang, "wrong_drink_name").format(DRINK_NAME_LENGTH))
             return
         try:
-            drink = Drink.get(Drink.server == server and Drink.name == drink_name)
+            drink = await engine.get_drink(server, drink_name)
         except DoesNotExist:
             await ctx.send(conf.lang(lang, "drink_not_found").format(drink_name))
         else:
@@ -165,11 +320,11 @@ class DrinkCog(commands.Cog):
     @drink.error
     async def drink_error(self, ctx, error):
         if isinstance(error, commands.BotMissingPermissions):
-            await ctx.send(conf.lang(get_lang_from_context(ctx), "missing_permissions", "drink"))
+            await ctx.send(conf.lang(await get_lang_from_context(ctx), "missing_permissions", "drink"))
             error.bcdb_checked = True
 
     @commands.command()
-    @commands.has_role("barman")
+    @barman_only()
     @commands.guild_only()
     async def add(self, ctx: Context, drink_name: str, intoxication: int = DEFAULT_INTOXICATION,
                   portion_size: int = DEFAULT_PORTION_SIZE,
@@ -185,7 +340,7 @@ class DrinkCog(commands.Cog):
         portions_per_day: portions of this drink available for one day, greater than 0 and less
         than 10000.
         """
-        server = get_server_from_context(ctx)
+        server = await get_server_from_context(ctx)
         lang = server.lang
         if not 0 <= intoxication <= 100:
             await ctx.send(conf.lang(lang, "wrong_intoxication"))
@@ -195,14 +350,15 @@ class DrinkCog(commands.Cog):
             await ctx.send(conf.lang(lang, "wrong_portions_per_day").format(PORTIONS_PER_DAY))
         elif drink_name is None or len(drink_name) > DRINK_NAME_LENGTH:
             await ctx.send(conf.lang(lang, "wrong_drink_name").format(DRINK_NAME_LENGTH))
-        elif not check_guild_drink_count(ctx.guild.id):
+        elif not await check_guild_drink_count(server):
             await ctx.send(conf.lang(lang, "too_many_drinks").format(DRINKS_PER_SERVER))
-        elif Drink.select().where(Drink.server == ctx.guild.id and Drink.name == drink_name).count() > 0:
+        elif await dbx.read(Drink.select().where((Drink.server == server) & (Drink.name == drink_name)).exists):
             await ctx.send(conf.lang(lang, "duplicate_drink").format(drink_name))
         else:
-            Drink.create(server=server, name=drink_name, intoxication=intoxication,
-                         portion_size=portion_size,
-                         portions_per_day=portions_per_day, portions_left=portions_per_day)
+            await dbx.write(Drink.create, server=server, name=drink_name, intoxication=intoxication,
+                            portion_size=portion_size,
+                            portions_per_day=portions_per_day, portions_left=portions_per_day)
+            pages.invalidate(server.id)
             await ctx.send(conf.lang(lang, "drink_added").format(drink_name))
             log.info("Added drink \"{0}\" on {1}".format(drink_name, ctx.guild.id))
 
@@ -212,7 +368,7 @@ class DrinkCog(commands.Cog):
         pass
 
     @commands.command()
-    @commands.has_role("barman")
+    @barman_only()
     @commands.guild_only()
     async def remove(self, ctx: Context, *, drink_name: str):
         """
@@ -221,18 +377,21 @@ class DrinkCog(commands.Cog):
         Parameters:
         drink_name: name of the drink, not empty
         """
-        server = get_server_from_context(ctx)
+        server = await get_server_from_context(ctx)
         lang = server.lang
         if drink_name is None or len(drink_name) > DRINK_NAME_LENGTH:
             await ctx.send(conf.lang(lang, "wrong_drink_name").format(DRINK_NAME_LENGTH))
             return
         try:
-            drink = Drink.get(Drink.server == server and Drink.name == drink_name)
-            drink.delete_instance()
-            await ctx.send(conf.lang(lang, "drink_deleted").format(drink_name))
-            log.info("Removed drink \"{0}\" from {1}".format(drink_name, ctx.guild.id))
+            drink = await engine.get_drink(server, drink_name, exact=True)
         except DoesNotExist:
             await ctx.send(conf.lang(lang, "drink_not_found").format(drink_name))
+        else:
+            engine.forget_drink(server, drink.name)
+            await dbx.write(drink.delete_instance)
+            pages.invalidate(server.id)
+            await ctx.send(conf.lang(lang, "drink_deleted").format(drink.name))
+            log.info("Removed drink \"{0}\" from {1}".format(drink.name, ctx.guild.id))
 
     @remove.error
     @not_barman
@@ -240,7 +399,7 @@ class DrinkCog(commands.Cog):
         pass
 
     @commands.command()
-    @commands.has_role("barman")
+    @barman_only()
     @commands.guild_only()
     async def restock(self, ctx: Context, *, drink_name: Optional[str]):
         """
@@ -249,23 +408,31 @@ class DrinkCog(commands.Cog):
         Parameters:
         drink_name: name of the drink
         """
-        server = get_server_from_context(ctx)
+        server = await get_server_from_context(ctx)
         lang = server.lang
         if drink_name is not None and len(drink_name) > DRINK_NAME_LENGTH:
             await ctx.send(conf.lang(lang, "wrong_drink_name").format(DRINK_NAME_LENGTH))
             return
         if drink_name is None:
-            (Drink.update(portions_left=Drink.portions_per_day)
-             .where(Drink.server == server)
-             ).execute()
+            now = int(time.time())
+            await dbx.write((Drink.update(portions_left=Drink.portions_per_day, restocked_at=now)
+                             .where(Drink.server == server)
+                             ).execute)
+            for drink in engine.cached_drinks(server):
+                drink.restock(now)
+            pages.invalidate(server.id)
             await ctx.send(conf.lang(lang, "restocked_all"))
             log.info("Restocked all drinks on {1}".format(drink_name, ctx.guild.id))
         else:
-            (Drink.update(portions_left=Drink.portions_per_day)
-             .where(Drink.server == server and Drink.name == drink_name)
-             ).execute()
-            await ctx.send(conf.lang(lang, "restocked_single").format(drink_name))
-            log.info("Restocked drink \"{0}\" on {1}".format(drink_name, ctx.guild.id))
+            try:
+                drink = await engine.get_drink(server, drink_name)
+            except DoesNotExist:
+                await ctx.send(conf.lang(lang, "drink_not_found").format(drink_name))
+                return
+            await engine.restock(drink)
+            pages.invalidate(server.id)
+            await ctx.send(conf.lang(lang, "restocked_single").format(drink.name))
+            log.info("Restocked drink \"{0}\" on {1}".format(drink.name, ctx.guild.id))
 
     @restock.error
     @not_barman
@@ -284,66 +451,60 @@ class DrinkCog(commands.Cog):
         drink_name: name of the drink
         to: member (can be mention)
         """
-        gid = ctx.guild.id
-        server = get_server_from_context(ctx)
+        server = await get_server_from_context(ctx)
         lang = server.lang
         try:
-            drink = Drink.get(Drink.server == server and Drink.name == drink_name)
+            drink = await engine.get_drink(server, drink_name)
         except DoesNotExist:
-            if not check_guild_drink_count(gid):
+            if not await check_guild_drink_count(server):
                 await ctx.send(conf.lang(lang, "too_many_drinks").format(DRINKS_PER_SERVER))
                 return
-            drink = Drink.create(server=server, name=drink_name, intoxication=DEFAULT_INTOXICATION,
-                                 portion_size=DEFAULT_PORTION_SIZE,
-                                 portions_per_day=DEFAULT_PORTIONS_PER_DAY,
-                                 portions_left=DEFAULT_PORTIONS_PER_DAY)
+            drink = await dbx.write(Drink.create, server=server, name=drink_name, intoxication=DEFAULT_INTOXICATION,
+                                    portion_size=DEFAULT_PORTION_SIZE,
+                                    portions_per_day=DEFAULT_PORTIONS_PER_DAY,
+                                    portions_left=DEFAULT_PORTIONS_PER_DAY)
+            engine.put_drink(server, drink)
+            pages.invalidate(server.id)
         msg = await ctx.send(
-            conf.lang(lang, "serve_message").format(author=ctx.author.mention, drink=drink_name,
+            conf.lang(lang, "serve_message").format(author=ctx.author.mention, drink=drink.name,
                                                     portion_size=drink.portion_size))
 
-        await msg.add_reaction(conf.lang(lang, "ok-emoji"))
-        await msg.add_reaction(conf.lang(lang, "no-emoji"))
-        expected = set(to)
-
-        def check(reaction, user):
-            return user in expected and str(reaction.emoji) in {conf.lang(lang, "ok-emoji"),
-                                                                conf.lang(lang, "no-emoji")}
-
-        while len(expected):
-            try:
-                reaction, user = await self.bot.wait_for("reaction_add", timeout=conf.limitation("serve_timeout"),
-                                                         check=check)
-            except asyncio.TimeoutError:
-                break
-            else:
-                expected.remove(user)
-                if str(reaction) == conf.lang(lang, "ok-emoji"):
-                    await give_a_drink(ctx, user, drink)
-        await msg.delete()
+        ok_emoji = conf.lang(lang, "ok-emoji")
+        no_emoji = conf.lang(lang, "no-emoji")
+        entry = ServeEntry(msg.id, ctx.channel.id, ctx.guild.id, ctx.author.id, drink.name,
+                           [member.id for member in to], ok_emoji, no_emoji)
+        await registry.register(entry)
+        try:
+            await msg.add_reaction(ok_emoji)
+            await msg.add_reaction(no_emoji)
+            await run_serve(entry, ctx.channel, ctx.guild)
+        finally:
+            await registry.unregister(entry.message_id)
+            await self._delete_serve_message(ctx.channel, msg.id, msg)
         log.info("Deleted message {0} on {1} by time exceeding".format(msg.id, ctx.guild.id))
 
     @serve.error
     async def serve_error(self, ctx, error):
-        lang = get_lang_from_context(ctx)
         if isinstance(error, commands.BotMissingPermissions):
-            await ctx.send(conf.lang(lang, "missing_permissions", "serve"))
+            await ctx.send(conf.lang(await get_lang_from_context(ctx), "missing_permissions", "serve"))
             error.bcdb_checked = True
 
     @commands.command()
-    @commands.has_role("barman")
+    @barman_only()
     @commands.guild_only()
     async def reset(self, ctx: Context, to_defaults: bool = False):
         """
         Reset all drinks to defaults. Barman role required.
         """
-        server = get_server_from_context(ctx)
+        server = await get_server_from_context(ctx)
         lang = server.lang
-        Drink.delete().where(Drink.server == server).execute()
+        engine.evict_server(server, persons=False)
+        invalidate_server(ctx.guild.id)
+        await dbx.write(Drink.delete().where(Drink.server == server).execute)
         if to_defaults:
             await add_default_drinks(ctx.guild)
-            await ctx.send(conf.lang(lang, "reset_to_defaults_complete"))
-        else:
-            await ctx.send(conf.lang(lang, "reset_complete"))
+        pages.invalidate(server.id)
+        await ctx.send(conf.lang(lang, "reset_to_defaults_complete" if to_defaults else "reset_complete"))
 
     @reset.error
     @not_barman
@@ -1,47 +1,138 @@
-from typing import Optional
+from typing import Iterable, Optional
 
 from discord import Guild
 from discord.ext.commands import Context
+from peewee import chunked
 
-from barcounter import confutils as conf, db, log
-from barcounter.dbentities import Server, Person, Drink
+from barcounter import confutils as conf, log, sharding
+from barcounter.dbentities import Server, Person, Drink, PendingServe, drink_key
+from barcounter.dbexecutor import dbx
+from barcounter.state import engine
 
+# rows per INSERT and guilds per transaction of the bulk operations
+INSERT_BATCH = 100
+RECONCILE_BATCH = 500
 
-def get_server_or_create(gid: int, preferred_locale: Optional[str]) -> Server:
-    preferred_locale = preferred_locale.replace("-", "_")
-    if preferred_locale is not None and preferred_locale in conf.get_langs():
-        return Server.get_or_create(sid=gid, defaults={"lang": preferred_locale})[0]
-    else:
-        return Server.get_or_create(sid=gid, defaults={"lang": "en_US"})[0]
+_servers = dict()
+_server_cache_stats = {"hits": 0, "misses": 0}
+# lang -> (default drinks of the catalog, rows made from them)
+_drink_templates = dict()
 
 
-def get_server_from_context(ctx: Context) -> Server:
-    return get_server_or_create(ctx.guild.id, ctx.guild.preferred_locale)
+def _guild_lang(preferred_locale: Optional[str]) -> str:
+    if preferred_locale is not None:
+        preferred_locale = str(preferred_locale).replace("-", "_")
+    return preferred_locale if preferred_locale in conf.get_langs() else "en_US"
 
 
-def get_lang(gid: int, preferred_locale: Optional[str]):
-    return get_server_or_create(gid, preferred_locale).lang
+async def get_server_or_create(gid: int, preferred_locale: Optional[str]) -> Server:
+    server = _servers.get(gid)
+    if server is not None:
+        _server_cache_stats["hits"] += 1
+        return server
+    _server_cache_stats["misses"] += 1
+    server, _ = await dbx.write(Server.get_or_create, sid=gid, defaults={"lang": _guild_lang(preferred_locale)})
+    return _servers.setdefault(gid, server)
 
 
-def get_lang_from_context(ctx: Context):
-    return get_lang(ctx.guild.id, ctx.guild.preferred_locale)
+def invalidate_server(gid: int):
+    """
+    Drops the cached server, the next get_server_or_create will load it from the database.
+    """
+    _servers.pop(gid, None)
 
 
-def get_lang_from_guild(guild: Guild):
-    return get_lang(guild.id, guild.preferred_locale)
+def server_cache_info():
+    return dict(_server_cache_stats, size=len(_servers))
 
 
-def get_person_or_create(gid: int, uid: int, preferred_locale: Optional[str]):
-    server = get_server_or_create(gid, preferred_locale)
-    return Person.get_or_create(server=server, uid=uid, defaults={"intoxication": 0})[0]
+async def get_server_from_context(ctx: Context) -> Server:
+    return await get_server_or_create(ctx.guild.id, ctx.guild.preferred_locale)
+
+
+async def get_lang(gid: int, preferred_locale: Optional[str]):
+    return (await get_server_or_create(gid, preferred_locale)).lang
+
+
+async def get_lang_from_context(ctx: Context):
+    return await get_lang(ctx.guild.id, ctx.guild.preferred_locale)
+
+
+async def get_lang_from_guild(guild: Guild):
+    return await get_lang(guild.id, guild.preferred_locale)
+
+
+async def get_person_or_create(gid: int, uid: int, preferred_locale: Optional[str]) -> Person:
+    server = await get_server_or_create(gid, preferred_locale)
+    return await engine.get_person(server, uid)
+
+
+def drink_template(lang: str):
+    """
+    Drink rows of the default drinks of the lang without the server, rebuilt when the catalog is reloaded.
+    """
+    default_drinks = conf.lang_all(lang, "default_drinks")
+    cached = _drink_templates.get(lang)
+    if cached is None or cached[0] is not default_drinks:
+        rows = tuple({"name": drink["name"], "name_key": drink_key(drink["name"]),
+                      "intoxication": drink["intoxication"], "portion_size": drink["portion"],
+                      "portions_per_day": drink["portions_per_day"], "portions_left": drink["portions_per_day"]}
+                     for drink in default_drinks)
+        cached = _drink_templates[lang] = (default_drinks, rows)
+    return cached[1]
+
+
+def insert_default_drinks(*servers: Server):
+    """
+    Adds the default drinks to the servers, the ones they already have are skipped.
+    Must be called inside a transaction on the db executor.
+    """
+    rows = [dict(row, server=server.id) for server in servers for row in drink_template(server.lang)]
+    for batch in chunked(rows, INSERT_BATCH):
+        Drink.insert_many(batch).on_conflict_ignore().execute()
 
 
 async def add_default_drinks(guild):
-    server = get_server_or_create(guild.id, guild.preferred_locale)
-    default_drinks = conf.lang_raw(server.lang, "default_drinks")
-    with db.atomic():
-        for default_drink in default_drinks:
-            Drink.create(server=server, name=default_drink.name, intoxication=default_drink.intoxication,
-                         portion_size=default_drink.portion, portions_per_day=default_drink.portions_per_day,
-                         portions_left=default_drink.portions_per_day)
+    server = await get_server_or_create(guild.id, guild.preferred_locale)
+    await dbx.write(insert_default_drinks, server)
     log.info("Added drinks to {0}".format(guild.id))
+
+
+def _create_servers(langs):
+    """
+    Creates the servers of the (sid, lang) pairs with the default drinks.
+    """
+    for batch in chunked([{"sid": sid, "lang": lang} for sid, lang in langs], INSERT_BATCH):
+        Server.insert_many(batch).on_conflict_ignore().execute()
+    servers = list(Server.select().where(Server.sid.in_([sid for sid, _ in langs])))
+    insert_default_drinks(*servers)
+    return servers
+
+
+def delete_servers(servers):
+    """
+    Deletes the servers with their pending serves, the persons and the drinks are deleted by the database.
+    """
+    PendingServe.delete().where(PendingServe.guild_id.in_([server.sid for server in servers])).execute()
+    Server.delete().where(Server.id.in_([server.id for server in servers])).execute()
+
+
+async def reconcile_servers(guilds: Iterable[Guild]):
+    """
+    Catches up with the guilds joined and left while the bot was offline: the missing servers are created
+    with the default drinks, the servers of the owned guilds the bot is no longer in are deleted.
+    Runs a transaction per RECONCILE_BATCH guilds and fills the server cache.
+    """
+    langs = {guild.id: guild.preferred_locale for guild in guilds}
+    known = {server.sid: server for server in await dbx.read(lambda: list(Server.select()))}
+    missing = [(sid, _guild_lang(locale)) for sid, locale in langs.items() if sid not in known]
+    # without any guild it's more likely a broken connection than an abandoned bot
+    gone = [server for sid, server in known.items() if sid not in langs and sharding.owns(sid)] if langs else []
+    for batch in chunked(missing, RECONCILE_BATCH):
+        for server in await dbx.write(_create_servers, batch):
+            known[server.sid] = server
+    for batch in chunked(gone, RECONCILE_BATCH):
+        await dbx.write(delete_servers, batch)
+    for sid in langs:
+        _servers.setdefault(sid, known[sid])
+    log.info("Reconciled {0} guilds: {1} servers created, {2} deleted".format(len(langs), len(missing), len(gone)))
@@ -1,6 +1,7 @@
+import asyncio
+
 import discord
 from discord.ext import commands
-from discord.utils import find
 
 from barcounter import log
 
@@ -8,37 +9,90 @@ logger = log
 
 ROLE_NAME = "barman"
 
+# guild id -> ids of the roles named ROLE_NAME, kept current by the role events
+_roles = dict()
+# guild id -> task creating the role
+_creating = dict()
+
+
+def _scan(guild: discord.Guild) -> frozenset:
+    return frozenset(role.id for role in guild.roles if role.name == ROLE_NAME)
+
+
+def role_ids(guild: discord.Guild) -> frozenset:
+    ids = _roles.get(guild.id)
+    if ids is None:
+        ids = _roles[guild.id] = _scan(guild)
+    return ids
+
+
+def has_barman_role(member: discord.Member) -> bool:
+    ids = role_ids(member.guild)
+    return any(role.id in ids for role in member.roles)
+
+
+async def _create_role(guild: discord.Guild):
+    try:
+        logger.info("creating role in {0.id} guild".format(guild))
+        role = await guild.create_role(name=ROLE_NAME, permissions=discord.Permissions.none())
+        _roles[guild.id] = role_ids(guild) | {role.id}
+    except discord.HTTPException:
+        logger.info("Can't create role in {0.id} guild".format(guild))
+    finally:
+        del _creating[guild.id]
 
-def is_role_powered(ctx):
-    rl = find(lambda r: r.name == ROLE_NAME, ctx.author.roles)
-    return rl is not None
 
+async def ensure_role(guild: discord.Guild):
+    """
+    Creates the role if the guild doesn't have one, concurrent calls share the creation.
+    """
+    if role_ids(guild):
+        return
+    task = _creating.get(guild.id)
+    if task is None:
+        task = _creating[guild.id] = asyncio.ensure_future(_create_role(guild))
+    await asyncio.shield(task)
 
-def get_role(bot: discord.ext.commands.Bot, guild: discord.Guild):
-    return bot.cogs["RoleRegistrarCog"].guild_to_role[guild]
+
+def barman_only():
+    """
+    Like commands.has_role(ROLE_NAME), the role is created on the first use in the guild.
+    """
+
+    async def predicate(ctx):
+        if ctx.guild is None:
+            raise commands.NoPrivateMessage()
+        if has_barman_role(ctx.author):
+            return True
+        await ensure_role(ctx.guild)
+        raise commands.MissingRole(ROLE_NAME)
+
+    return commands.check(predicate)
 
 
 class RoleRegistrarCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.guild_to_role = dict()
 
-    async def bot_check_once(self, ctx):
-        return await self.on_guild_join(ctx.guild)
+    @commands.Cog.listener()
+    async def on_guild_role_create(self, role: discord.Role):
+        if role.name == ROLE_NAME:
+            _roles[role.guild.id] = role_ids(role.guild) | {role.id}
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if before.name != after.name and ROLE_NAME in (before.name, after.name):
+            _roles[after.guild.id] = _scan(after.guild)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        ids = _roles.get(role.guild.id)
+        if ids is not None and role.id in ids:
+            _roles[role.guild.id] = ids - {role.id}
 
     @commands.Cog.listener()
-    async def on_guild_join(self, guild):
-        if guild not in self.guild_to_role:
-            self.guild_to_role[guild] = await self._check_role_existence(guild)
-        return True
-
-    @staticmethod
-    async def _check_role_existence(guild):
-        if ROLE_NAME not in map(lambda x: x.name, guild.roles):
-            logger.info("creating role in {0.id} guild".format(guild))
-            return await guild.create_role(name=ROLE_NAME, permissions=discord.Permissions.none())
-        else:
-            return find(lambda a: a.name == ROLE_NAME, guild.roles)
+    async def on_guild_remove(self, guild: discord.Guild):
+        _roles.pop(guild.id, None)
 
 
 def setup(bot):
@@ -1,24 +1,47 @@
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
 from discord.ext import commands
 from discord.ext.commands import Bot, Context
 
-from barcounter import confutils as conf, db
+from barcounter import confutils as conf, metrics, pages
 from barcounter import log
-from barcounter.cogs.helpers import get_server_or_create, add_default_drinks, get_lang_from_context
+from barcounter.cogs.helpers import get_server_or_create, insert_default_drinks, get_lang_from_context, \
+    invalidate_server
 from barcounter.confutils import get_langs
 from barcounter.dbentities import Server, Drink
+from barcounter.dbexecutor import dbx
+from barcounter.ratelimit import RateLimited, limiter
+from barcounter.state import engine
 
 logger = log
 
 
+def set_lang(server: Server, lang_code: str):
+    server.lang = lang_code
+    Server.update(lang=lang_code).where(Server.id == server.id).execute()
+    Drink.delete().where(Drink.server == server).execute()
+    insert_default_drinks(server)
+
+
 class SettingsCog(commands.Cog):
     def __init__(self, bot):
         self.bot: Bot = bot
+        conf.watch(bot.loop)
+
+    def cog_unload(self):
+        conf.unwatch()
 
     @commands.Cog.listener()
     async def on_command_error(self, ctx: Context, error):
+        if isinstance(error, RateLimited):
+            metrics.command_throttled.inc(error.command, error.scope)
+            if error.notify:
+                await ctx.send(conf.lang(await get_lang_from_context(ctx), "rate_limited")
+                               .format(max(1, round(error.retry_after))))
+            return True
         if not hasattr(error, "bcdb_checked") or not error.bcdb_checked:
             log.error("Error on command {0}".format(ctx.command), exc_info=error)
-            await ctx.send(conf.lang(get_lang_from_context(ctx), "on_error"))
+            await ctx.send(conf.lang(await get_lang_from_context(ctx), "on_error"))
         return True
 
     @commands.group()
@@ -34,11 +57,11 @@ class SettingsCog(commands.Cog):
                 await ctx.send(conf.international("incorrect_language"))
             else:
                 logger.info("Updated lang on {0} to {1}".format(ctx.guild.id, lang_code))
-                with db.atomic():
-                    server = get_server_or_create(ctx.guild.id, ctx.guild.preferred_locale)
-                    Server.update(lang=lang_code).where(Server.sid == ctx.guild.id).execute()
-                    Drink.delete().where(Drink.server == server.id).execute()
-                    await add_default_drinks(ctx.guild)
+                server = await get_server_or_create(ctx.guild.id, ctx.guild.preferred_locale)
+                engine.evict_server(server, persons=False)
+                invalidate_server(ctx.guild.id)
+                await dbx.write(set_lang, server, lang_code)
+                pages.invalidate(server.id)
                 await ctx.send(conf.lang(lang_code, "lang_selected"))
         else:
             langs = "\n".join(
@@ -50,11 +73,52 @@ class SettingsCog(commands.Cog):
         if isinstance(error, commands.MissingPermissions):
             await ctx.send(conf.international("missing_permissions"))
 
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(manage_guild=True)
+    async def restocktime(self, ctx: Context, time: str, timezone: str = "UTC"):
+        """
+        Sets the time of the daily restock. Requires Manage Guild permission.
+
+        Parameters:
+        time: local time in HH:MM format
+        timezone: name of the timezone, for example Europe/Moscow. UTC by default
+        """
+        lang = await get_lang_from_context(ctx)
+        try:
+            hours, minutes = map(int, time.split(":"))
+            ZoneInfo(timezone)
+        except (ValueError, ZoneInfoNotFoundError):
+            hours, minutes = -1, -1
+        if not (0 <= hours < 24 and 0 <= minutes < 60):
+            await ctx.send(conf.lang(lang, "wrong_restock_time"))
+            return
+        invalidate_server(ctx.guild.id)
+        await dbx.write(Server.update(timezone=timezone, restock_time=hours * 60 + minutes)
+                        .where(Server.sid == ctx.guild.id).execute)
+        await ctx.send(conf.lang(lang, "restock_time_set").format("{0:02}:{1:02}".format(hours, minutes), timezone))
+        logger.info("Updated restock time on {0} to {1:02}:{2:02} {3}".format(ctx.guild.id, hours, minutes, timezone))
+
+    @restocktime.error
+    async def restocktime_error(self, ctx, error):
+        if isinstance(error, commands.MissingPermissions):
+            await ctx.send(conf.international("missing_permissions"))
+
 
 async def globally_block_dms(ctx):
     return ctx.guild is not None
 
 
+async def globally_rate_limit(ctx):
+    command = ctx.command.root_parent or ctx.command
+    # the help command checks the other commands too, they aren't invoked
+    if ctx.invoked_with not in (command.name, *command.aliases):
+        return True
+    limiter.acquire(command.name, ctx.guild.id, ctx.author.id, len(ctx.message.mentions))
+    return True
+
+
 def setup(bot):
     bot.add_check(globally_block_dms)
+    bot.add_check(globally_rate_limit)
     bot.add_cog(SettingsCog(bot))
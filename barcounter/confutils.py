@@ -1,36 +1,185 @@
+import asyncio
+import os
 import random
-from collections import Iterable
+from collections.abc import Iterable, Mapping
+from string import Formatter
+from types import MappingProxyType
 
 from dynaconf import settings
 
+from barcounter import log
 
-def lang_raw(lang_code, *path):
-    package = settings.LANG[lang_code]
-    for p in path:
-        package = package[p]
-    return package
+logger = log
+
+FALLBACK_LANG = "en_US"
+RELOAD_INTERVAL = settings.CATALOG["reload_interval"]
+
+_formatter = Formatter()
+
+
+class Template(str):
+    """
+    String of the catalog parsed once, fields are the names of its replacement fields.
+    Formatting is still str.format, it has no reusable compiled form.
+    """
+    __slots__ = ("fields",)
+
+    def __new__(cls, text: str):
+        template = super().__new__(cls, text)
+        # raises ValueError on a malformed template
+        template.fields = frozenset(field.split(".")[0].split("[")[0]
+                                    for _, field, _, _ in _formatter.parse(text) if field is not None)
+        return template
+
+
+class Catalog:
+    """
+    Flat read-only snapshot of the LANG and INTERNATIONAL settings.
+
+    Every leaf of LANG is stored under its full path, so a lookup is a single dict access.
+    The missing paths of a language are resolved to en_US at compile time,
+    variant lists are stored as tuples and strings are parsed once into templates. A malformed template
+    or one using a field that the en_US one doesn't fails the compilation instead of a command.
+    """
+
+    def __init__(self, langs, international):
+        fallback = self._flatten(langs.get(FALLBACK_LANG, dict()))
+        own = dict()
+        merged = dict()
+        for lang_code, package in langs.items():
+            table = self._flatten(package)
+            self._check_fields(lang_code, table, fallback)
+            own[lang_code] = MappingProxyType(table)
+            merged[lang_code] = MappingProxyType({**fallback, **table})
+        self.own = MappingProxyType(own)
+        self.merged = MappingProxyType(merged)
+        self.international = MappingProxyType({name: self._freeze(value) for name, value in international.items()})
+
+    @staticmethod
+    def _fields(value) -> frozenset:
+        if isinstance(value, Template):
+            return value.fields
+        if isinstance(value, tuple):
+            return frozenset().union(*(Catalog._fields(item) for item in value))
+        return frozenset()
+
+    @classmethod
+    def _check_fields(cls, lang_code, table, fallback):
+        for path, value in table.items():
+            if path not in fallback:
+                continue
+            extra = cls._fields(value) - cls._fields(fallback[path])
+            if extra:
+                raise ValueError("{0} {1} uses fields {2} unknown to {3}".format(
+                    lang_code, ".".join(map(str, path)), ", ".join(sorted(extra)), FALLBACK_LANG))
+
+    @classmethod
+    def _flatten(cls, package, prefix=()):
+        table = dict()
+        for key, value in package.items():
+            path = prefix + (key,)
+            if isinstance(value, Mapping):
+                table.update(cls._flatten(value, path))
+            else:
+                table[path] = cls._freeze(value)
+        return table
+
+    @classmethod
+    def _freeze(cls, value):
+        if isinstance(value, str):
+            return Template(value)
+        if isinstance(value, Mapping):
+            return MappingProxyType({key: cls._freeze(item) for key, item in value.items()})
+        if isinstance(value, Iterable):
+            return tuple(cls._freeze(item) for item in value)
+        return value
+
+
+def compile_catalog() -> Catalog:
+    return Catalog(settings.LANG, settings.INTERNATIONAL)
+
+
+_catalog = compile_catalog()
 
 
 def lang(lang_code, *path, fail_to_en_us=True):
-    package = settings.LANG[lang_code]
-    for p in path:
-        if p not in package and lang_code != "en_US" and fail_to_en_us:
-            return lang("en_US", *path)
-        package = package[p]
-    if isinstance(package, Iterable) and not isinstance(package, str):
-        return random.choice(list(package))
-    else:
-        return package
+    tables = _catalog.merged if fail_to_en_us else _catalog.own
+    value = tables[lang_code][path]
+    if isinstance(value, tuple):
+        return random.choice(value)
+    return value
+
+
+def lang_all(lang_code, *path):
+    """
+    Like lang, but every variant of the string or the whole list.
+    The value stays the same until the catalog is reloaded.
+    """
+    value = _catalog.merged[lang_code][path]
+    return value if isinstance(value, tuple) else (value,)
 
 
 def get_langs():
-    package = settings.LANG
-    return package.keys()
+    return _catalog.merged.keys()
 
 
 def international(name):
-    return settings.INTERNATIONAL[name]
+    return _catalog.international[name]
 
 
 def limitation(name):
     return settings.LIMITATIONS[name]
+
+
+def reload():
+    """
+    Reloads the settings files and swaps in the recompiled catalog.
+    The previous catalog stays in use if the new one doesn't compile.
+    """
+    global _catalog
+    settings.reload()
+    try:
+        _catalog = compile_catalog()
+    except (ValueError, KeyError, TypeError):
+        logger.exception("Localization catalog is not reloaded")
+        return
+    logger.info("Localization catalog is reloaded, languages: {0}".format(", ".join(get_langs())))
+
+
+def _mtimes():
+    mtimes = dict()
+    for path in set(settings._loaded_files):
+        try:
+            mtimes[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            mtimes[path] = None
+    return mtimes
+
+
+async def _watch_loop(mtimes):
+    while True:
+        await asyncio.sleep(RELOAD_INTERVAL)
+        current = _mtimes()
+        if current != mtimes:
+            reload()
+            mtimes = _mtimes()
+
+
+_watcher = None
+
+
+def watch(loop):
+    """
+    Starts polling the settings files, the catalog is reloaded when one of them changes.
+    Disabled with CATALOG.reload_interval = 0.
+    """
+    global _watcher
+    if _watcher is None and RELOAD_INTERVAL > 0:
+        _watcher = loop.create_task(_watch_loop(_mtimes()))
+
+
+def unwatch():
+    global _watcher
+    if _watcher is not None:
+        _watcher.cancel()
+        _watcher = None
@@ -0,0 +1,26 @@
+from peewee import SqliteDatabase
+from playhouse.pool import PooledPostgresqlDatabase, PooledSqliteDatabase
+
+BACKENDS = ("sqlite", "pooled_sqlite", "postgres")
+
+
+def create_database(settings):
+    """
+    Builds the database of DB_BACKEND.
+
+    sqlite: DB_LOCATION file, a connection per thread.
+    pooled_sqlite: DB_LOCATION file, connections are reused through a DB_POOL sized pool.
+    postgres: DB_POSTGRES server through a DB_POOL sized pool, requires psycopg2.
+    """
+    backend = settings.DB_BACKEND
+    if backend == "sqlite":
+        return SqliteDatabase(settings["DB_LOCATION"], autoconnect=True, autocommit=True,
+                              pragmas=dict(settings.DB_PRAGMAS))
+    if backend == "pooled_sqlite":
+        # pooled connections are handed over between threads
+        return PooledSqliteDatabase(settings["DB_LOCATION"], autoconnect=True, autocommit=True,
+                                    pragmas=dict(settings.DB_PRAGMAS), check_same_thread=False, **settings.DB_POOL)
+    if backend == "postgres":
+        return PooledPostgresqlDatabase(autoconnect=True, autocommit=True, **settings.DB_POSTGRES,
+                                        **settings.DB_POOL)
+    raise ValueError("Unknown DB_BACKEND {0}, expected one of {1}".format(backend, ", ".join(BACKENDS)))
@@ -1,3 +1,7 @@
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
 from peewee import *
 
 from barcounter import confutils as conf
@@ -11,21 +15,123 @@ class AbstractModel(Model):
         database = db
 
 
+def _now(now: int = None) -> int:
+    return int(time.time()) if now is None else now
+
+
+def drink_key(name: str) -> str:
+    """
+    Case-insensitive form of the drink name, used for lookups.
+    """
+    return name.casefold()
+
+
 class Server(AbstractModel):
-    sid = IntegerField()
+    sid = BigIntegerField(unique=True)
     lang = CharField()
+    timezone = CharField(default="UTC")
+    # minutes after the local midnight
+    restock_time = IntegerField(default=0)
+
+    def last_restock(self, now: int = None) -> int:
+        """
+        Unix time of the latest daily restock moment in the timezone of the server.
+        """
+        local = datetime.fromtimestamp(_now(now), ZoneInfo(self.timezone))
+        boundary = local.replace(hour=self.restock_time // 60, minute=self.restock_time % 60, second=0,
+                                 microsecond=0)
+        if boundary > local:
+            boundary -= timedelta(days=1)
+        return int(boundary.timestamp())
 
 
 class Person(AbstractModel):
-    uid = IntegerField()
-    server = ForeignKeyField(Server, backref="persons")
+    uid = BigIntegerField()
+    server = ForeignKeyField(Server, backref="persons", on_delete="CASCADE")
     intoxication = IntegerField()
+    intoxication_updated = BigIntegerField(default=_now)
+
+    def current_intoxication(self, now: int = None) -> int:
+        """
+        Intoxication lowers by 1% each minute since the last update.
+        """
+        return max(0, self.intoxication - (_now(now) - self.intoxication_updated) // 60)
+
+    def set_intoxication(self, intoxication: int, now: int = None):
+        self.intoxication = intoxication
+        self.intoxication_updated = _now(now)
+
+    class Meta:
+        indexes = (
+            (("server", "uid"), True),
+        )
 
 
 class Drink(AbstractModel):
-    server = ForeignKeyField(Server, backref="drinks")
+    server = ForeignKeyField(Server, backref="drinks", on_delete="CASCADE")
     name = CharField(max_length=DRINK_NAME_LENGTH)
+    name_key = CharField(max_length=DRINK_NAME_LENGTH)
     intoxication = IntegerField()
     portion_size = IntegerField()
     portions_per_day = IntegerField()
     portions_left = IntegerField()
+    restocked_at = BigIntegerField(default=_now)
+
+    def save(self, *args, **kwargs):
+        self.name_key = drink_key(self.name)
+        return super().save(*args, **kwargs)
+
+    def restock(self, now: int = None):
+        self.portions_left = self.portions_per_day
+        self.restocked_at = _now(now)
+
+    def restock_if_due(self, last_restock: int, now: int = None) -> bool:
+        """
+        Restocks the drink if it wasn't restocked since the last restock moment of the server.
+        """
+        if self.restocked_at < last_restock:
+            self.restock(now)
+            return True
+        return False
+
+    class Meta:
+        indexes = (
+            (("server", "name"), True),
+            (("server", "name_key"), False),
+        )
+
+
+class PendingServe(AbstractModel):
+    """
+    Serve waiting for answers, stored only with SERVE.persist enabled.
+    """
+    message_id = BigIntegerField(unique=True)
+    channel_id = BigIntegerField()
+    guild_id = BigIntegerField()
+    author_id = BigIntegerField()
+    drink_name = CharField(max_length=DRINK_NAME_LENGTH)
+    # space-separated ids of the members who haven't answered yet
+    expected = TextField()
+    # unix time
+    deadline = BigIntegerField()
+
+
+class Joke(AbstractModel):
+    """
+    Joke of the local store. The slots of a lang are numbered from 0 without gaps, so a random one is an index lookup.
+    """
+    lang = CharField()
+    # sha1 of the text
+    digest = CharField(max_length=40)
+    text = TextField()
+    slot = IntegerField()
+
+    class Meta:
+        indexes = (
+            (("lang", "digest"), True),
+            (("lang", "slot"), True),
+        )
+
+
+class SchemaVersion(AbstractModel):
+    version = IntegerField()
@@ -0,0 +1,49 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from dynaconf import settings
+from peewee import SqliteDatabase
+
+from barcounter import db
+
+
+class DatabaseExecutor:
+    """
+    Runs peewee work off the event loop.
+
+    Writes are serialized on a single thread, each call in its own transaction.
+    On SQLite the write transactions take the write lock upfront, so with several processes on one file
+    a transaction that read first waits for busy_timeout instead of failing on the lock upgrade.
+    Reads go to the reader threads, or to the writer thread if there are none.
+    Every thread keeps its own connection.
+    The calls run in a copy of the caller's context, so the metrics know the command behind a query.
+    """
+
+    def __init__(self, reader_threads: int):
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        if reader_threads > 0:
+            self._readers = ThreadPoolExecutor(max_workers=reader_threads, thread_name_prefix="db-reader")
+        else:
+            self._readers = self._writer
+
+    @staticmethod
+    def _atomic(fn, *args, **kwargs):
+        with db.atomic("IMMEDIATE") if isinstance(db, SqliteDatabase) else db.atomic():
+            return fn(*args, **kwargs)
+
+    async def write(self, fn, *args, **kwargs):
+        call = functools.partial(contextvars.copy_context().run, self._atomic, fn, *args, **kwargs)
+        return await asyncio.get_event_loop().run_in_executor(self._writer, call)
+
+    async def read(self, fn, *args, **kwargs):
+        call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+        return await asyncio.get_event_loop().run_in_executor(self._readers, call)
+
+    def shutdown(self):
+        self._writer.shutdown()
+        self._readers.shutdown()
+
+
+dbx = DatabaseExecutor(settings.DB_READER_THREADS)
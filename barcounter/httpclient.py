@@ -0,0 +1,114 @@
+import asyncio
+import random
+import time
+
+import aiohttp
+from dynaconf import settings
+
+from barcounter import log, metrics
+
+logger = log
+
+
+class SourceUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and lets probes through after `reset_timeout` seconds.
+    A failed probe opens it again.
+    """
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        return self.opened_at is None or time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+_session = None
+_breakers = dict()
+
+
+def _option(source, name):
+    if name in source:
+        return source[name]
+    return settings.HTTP[name]
+
+
+def _get_session():
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=settings.HTTP["pool_size"],
+                                         keepalive_timeout=settings.HTTP["keepalive_timeout"])
+        _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+
+def get_breaker(name):
+    if name not in _breakers:
+        _breakers[name] = CircuitBreaker(settings.HTTP["breaker_threshold"], settings.HTTP["breaker_reset"])
+    return _breakers[name]
+
+
+def is_available(name):
+    return get_breaker(name).allow()
+
+
+async def fetch(source, as_json=False):
+    """
+    Fetches the url of the joke source through the shared session.
+
+    :param source: JOKE_SOURCE entry, may override connect_timeout, read_timeout and retries
+    :param as_json: decode the body as json instead of text
+    :raise SourceUnavailable: the breaker of the source is open or all retries failed
+    """
+    breaker = get_breaker(source["name"])
+    if not breaker.allow():
+        raise SourceUnavailable("{0} is skipped: circuit is open".format(source["name"]))
+    timeout = aiohttp.ClientTimeout(sock_connect=_option(source, "connect_timeout"),
+                                    sock_read=_option(source, "read_timeout"))
+    retries = _option(source, "retries")
+    backoff = settings.HTTP["retry_backoff"]
+    with metrics.timed(metrics.fetch_seconds, source["name"]):
+        return await _fetch_with_retries(source, breaker, timeout, retries, backoff, as_json)
+
+
+async def _fetch_with_retries(source, breaker, timeout, retries, backoff, as_json):
+    for attempt in range(retries + 1):
+        try:
+            async with _get_session().get(source["url"], timeout=timeout) as res:
+                res.raise_for_status()
+                if as_json:
+                    body = await res.json(content_type=None)
+                else:
+                    body = await res.text(encoding="utf-8")
+            breaker.success()
+            return body
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.warning("Fetch from {0} failed, attempt {1}: {2!r}".format(source["name"], attempt + 1, e))
+            if attempt < retries:
+                await asyncio.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+    breaker.failure()
+    metrics.fetch_failures.inc(source["name"])
+    raise SourceUnavailable("{0} failed after {1} attempts".format(source["name"], retries + 1))
+
+
+async def close():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
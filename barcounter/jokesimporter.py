@@ -1,57 +1,101 @@
-import random
+import asyncio
+from collections import deque
 
-import requests
-from bs4 import BeautifulSoup, ParserRejectedMarkup
 from dynaconf import settings
-from requests import HTTPError
 
-from barcounter import log
+from barcounter import confutils as conf, log, metrics
+from barcounter.dbexecutor import dbx
+from barcounter.jokesources import registry
+from barcounter.jokestore import store
 
 logger = log
 
+POOL_SIZE = settings.JOKE_POOL["size"]
+POOL_LOW_WATERMARK = settings.JOKE_POOL["low_watermark"]
 
-def _ru_ru_get_joke():
-    try:
-        package = settings.JOKE_SOURCE["ru_RU"]
-        url = package.url
-        name = package.name
-        res = requests.get(url)
-        res.encoding = 'utf-8'
-        res.raise_for_status()
-        soup = BeautifulSoup(res.content, features="html.parser")
-        lst = soup.select(".text[id]")
-        item = random.choice(lst)
-        out = ""
-        for content in item.contents:
-            if content.name == "br":
-                out += '\n'
-            else:
-                out += str(content)
-        return out + "\n(c) " + name
-    except (HTTPError, ParserRejectedMarkup, IndexError) as e:
-        logger.error(str(e))
-        return None
-
-
-def _en_us_get_joke():
-    try:
-        package = settings.JOKE_SOURCE["en_US"]
-        res = requests.get(package.url)
-        res.encoding = 'utf-8'
-        res.raise_for_status()
-        json_res = res.json()
-        joke_setup = json_res.get('setup', None)
-        joke_punchline = json_res.get('punchline', None)
-        assert joke_setup is not None
-        assert joke_punchline is not None
-        return "{setup} {punchline}".format(setup=joke_setup, punchline=joke_punchline)
-    except (HTTPError, AssertionError) as e:
-        logger.error(str(e))
-        return None
+_pools = dict()
+_refilling = set()
+_store_loading = None
+
+
+def _get_pool(lang):
+    if lang not in _pools:
+        _pools[lang] = deque(maxlen=POOL_SIZE)
+    return _pools[lang]
+
+
+async def _load_store():
+    global _store_loading
+    if _store_loading is None:
+        _store_loading = asyncio.ensure_future(dbx.write(store.load))
+        _store_loading.add_done_callback(_store_loaded)
+    await _store_loading
+
+
+def _store_loaded(future):
+    global _store_loading
+    if future.cancelled() or future.exception() is not None:
+        # a failed load, e.g. a locked database at startup, is retried by the next refill
+        _store_loading = None
+
+
+def _source_available(lang):
+    return registry.available(lang)
+
+
+async def _fill_pool(lang):
+    """
+    Fetches jokes into the store until the pool of the lang is full with the new ones,
+    the source gives nothing or only the stored jokes. The rest of the pool is taken from the store at random.
+    """
+    pool = _get_pool(lang)
+    with metrics.timed(metrics.job_seconds, "joke_refill_" + lang):
+        await _load_store()
+        while len(pool) < POOL_SIZE and _source_available(lang):
+            jokes = await registry.fetch(lang)
+            new = await dbx.write(store.add, lang, jokes) if jokes else []
+            if not new:
+                break
+            pool.extend(new[:POOL_SIZE - len(pool)])
+        if len(pool) < POOL_SIZE:
+            pool.extend(await dbx.read(store.sample, lang, POOL_SIZE - len(pool)))
+    logger.info("Joke pool of {0} refilled, {1} jokes available".format(lang, len(pool)))
+
+
+def _schedule_refill(lang):
+    # before the store is loaded, its size is unknown
+    stored = _store_loading is None or not _store_loading.done() or store.size(lang) > 0
+    if lang in _refilling or not (stored or _source_available(lang)):
+        return
+    _refilling.add(lang)
+    task = asyncio.ensure_future(_fill_pool(lang))
+    task.add_done_callback(lambda f: _refill_done(lang, f))
+
+
+def _refill_done(lang, task):
+    _refilling.discard(lang)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Joke pool of {0} is not refilled: {1!r}".format(lang, task.exception()))
+
+
+def prefill():
+    """
+    Starts background filling of the pools of every supported lang, the stored jokes are served without network.
+    """
+    for lang in conf.get_langs():
+        _schedule_refill(lang)
 
 
 def get_joke(lang):
-    if lang == "ru_RU":
-        return _ru_ru_get_joke()
-    elif lang == "en_US":
-        return _en_us_get_joke()
+    """
+    Pops a prefetched joke without touching the network.
+    Refill is scheduled in the background when the pool goes below the low watermark,
+    from the store only while the circuit of the source is open.
+
+    :return: joke or None, if the pool is empty
+    """
+    pool = _get_pool(lang)
+    joke = pool.popleft() if pool else None
+    if len(pool) <= POOL_LOW_WATERMARK:
+        _schedule_refill(lang)
+    return joke
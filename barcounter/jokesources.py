@@ -0,0 +1,181 @@
+import asyncio
+import random
+from typing import List
+
+from dynaconf import settings
+
+from barcounter import log
+from barcounter.httpclient import fetch, is_available, SourceUnavailable
+
+logger = log
+
+# sources of a lang fetched at once by a refill
+RACE = settings.JOKE_POOL["race"]
+
+
+class Provider:
+    """
+    Joke source of a JOKE_SOURCE entry: name, type, weight (1 by default) and concurrency,
+    the number of fetches from it at once (1 by default).
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.name = source["name"]
+        self.weight = source.get("weight", 1)
+        self.concurrency = source.get("concurrency", 1)
+        self._semaphore = None
+
+    def available(self) -> bool:
+        return True
+
+    async def fetch(self) -> List[str]:
+        """
+        :return: jokes, empty if the source failed
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            try:
+                return await self._fetch()
+            except SourceUnavailable as e:
+                logger.error(str(e))
+                return []
+
+    async def _fetch(self) -> List[str]:
+        raise NotImplementedError
+
+
+class JsonProvider(Provider):
+    """
+    url answering with an object or a list of objects, template is formatted with the fields of each.
+    """
+
+    def available(self) -> bool:
+        return is_available(self.name)
+
+    async def _fetch(self):
+        body = await fetch(self.source, as_json=True)
+        items = body if isinstance(body, list) else [body]
+        try:
+            return [self.source["template"].format(**item) for item in items]
+        except (KeyError, IndexError, TypeError) as e:
+            logger.error("Unexpected answer of {0}: {1!r}".format(self.name, e))
+            return []
+
+
+class HtmlProvider(Provider):
+    """
+    url of a page, every element matching the CSS selector is a joke, <br> are new lines.
+    With attribution, the name of the source is appended.
+    """
+
+    def available(self) -> bool:
+        return is_available(self.name)
+
+    async def _fetch(self):
+        content = await fetch(self.source)
+        return await asyncio.get_event_loop().run_in_executor(None, self._parse, content)
+
+    def _parse(self, content):
+        # bs4 is slow to import and needed only by the refill
+        from bs4 import BeautifulSoup, ParserRejectedMarkup
+        try:
+            soup = BeautifulSoup(content, features="html.parser")
+        except ParserRejectedMarkup as e:
+            logger.error(str(e))
+            return []
+        jokes = []
+        for item in soup.select(self.source["selector"]):
+            out = ""
+            for part in item.contents:
+                if part.name == "br":
+                    out += '\n'
+                else:
+                    out += str(part)
+            if self.source.get("attribution", False):
+                out += "\n(c) " + self.name
+            jokes.append(out)
+        random.shuffle(jokes)
+        return jokes
+
+
+class FileProvider(Provider):
+    """
+    Local text file in the fortune format: jokes separated by lines with a single %.
+    Gives batch (10 by default) random jokes of the file.
+    """
+
+    def __init__(self, source):
+        super().__init__(source)
+        self.batch = source.get("batch", 10)
+        self._jokes = None
+
+    def _read(self):
+        with open(self.source["path"], encoding="utf-8") as file:
+            jokes = [joke.strip() for joke in file.read().split("\n%\n")]
+        return [joke for joke in jokes if joke]
+
+    async def _fetch(self):
+        if self._jokes is None:
+            try:
+                self._jokes = await asyncio.get_event_loop().run_in_executor(None, self._read)
+            except OSError as e:
+                raise SourceUnavailable("{0} is not readable: {1}".format(self.name, e))
+        return random.sample(self._jokes, min(self.batch, len(self._jokes)))
+
+
+PROVIDERS = {
+    "json": JsonProvider,
+    "html": HtmlProvider,
+    "file": FileProvider,
+}
+
+
+def create_provider(source) -> Provider:
+    kind = source.get("type")
+    if kind not in PROVIDERS:
+        raise ValueError("Unknown type {0} of joke source {1}, expected one of {2}".format(
+            kind, source.get("name"), ", ".join(PROVIDERS)))
+    return PROVIDERS[kind](source)
+
+
+class SourceRegistry:
+    """
+    Providers of every lang declared in JOKE_SOURCE, a lang takes a list of sources or a single one.
+    """
+
+    def __init__(self, declared):
+        self.providers = dict()
+        for lang, sources in declared.items():
+            if "name" in sources:
+                sources = [sources]
+            self.providers[lang] = [create_provider(source) for source in sources]
+
+    def available(self, lang) -> bool:
+        return any(provider.available() for provider in self.providers.get(lang, ()))
+
+    async def fetch(self, lang) -> List[str]:
+        """
+        Fetches from up to RACE available sources of the lang picked by weight, the first non-empty answer wins.
+        """
+        candidates = [provider for provider in self.providers.get(lang, ()) if provider.available()]
+        racers = []
+        while candidates and len(racers) < RACE:
+            weights = [provider.weight for provider in candidates]
+            # the sources of weight 0 are fallbacks
+            provider = random.choices(candidates, weights)[0] if any(weights) else candidates[0]
+            candidates.remove(provider)
+            racers.append(asyncio.ensure_future(provider.fetch()))
+        try:
+            for finished in asyncio.as_completed(racers):
+                jokes = await finished
+                if jokes:
+                    return jokes
+            return []
+        finally:
+            for racer in racers:
+                racer.cancel()
+
+
+registry = SourceRegistry(settings.JOKE_SOURCE)
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import random
+from typing import List
+
+from dynaconf import settings
+from peewee import chunked, fn
+
+from barcounter import log
+from barcounter.dbentities import Joke
+
+logger = log
+
+MAX_SIZE = settings.JOKE_STORE["max_size"]
+CORPUS = settings.JOKE_STORE["corpus"] or os.path.join(os.path.dirname(os.path.abspath(__file__)), "jokes.json")
+INSERT_BATCH = 100
+
+
+def digest(text: str) -> str:
+    return hashlib.sha1(text.strip().encode("utf-8")).hexdigest()
+
+
+class JokeStore:
+    """
+    Jokes of every lang in the Joke table, deduplicated by the hash of the text.
+
+    The slots of a lang are numbered from 0, so a random joke is a lookup of a random slot.
+    Up to max_size jokes are kept per lang, then a new joke replaces the one in a random slot.
+    The methods run on the db executor, add and load in a write transaction.
+    Other processes may add to the same table, so add takes the next slot from the table, not from counts.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        # lang -> number of the used slots
+        self.counts = dict()
+
+    def load(self, corpus: str = CORPUS):
+        """
+        Counts the stored jokes, trims the langs over max_size and seeds the empty langs from the corpus file.
+        """
+        Joke.delete().where(Joke.slot >= self.max_size).execute()
+        self.counts = dict(Joke.select(Joke.lang, fn.COUNT(Joke.id)).group_by(Joke.lang).tuples())
+        try:
+            with open(corpus, encoding="utf-8") as file:
+                seeds = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning("Joke corpus is not loaded: {0}".format(e))
+            seeds = dict()
+        for lang, jokes in seeds.items():
+            if not self.counts.get(lang):
+                self.add(lang, jokes)
+                logger.info("Seeded {0} jokes of {1}".format(self.counts.get(lang, 0), lang))
+
+    def add(self, lang: str, jokes: List[str]) -> List[str]:
+        """
+        :return: the jokes which weren't stored yet
+        """
+        unique = dict()
+        for joke in jokes:
+            unique.setdefault(digest(joke), joke)
+        if not unique:
+            return []
+        known = set()
+        for batch in chunked(list(unique), INSERT_BATCH):
+            known.update(Joke.select(Joke.digest).where((Joke.lang == lang) & Joke.digest.in_(batch)).tuples())
+        new = [(key, joke) for key, joke in unique.items() if (key,) not in known]
+        count = self._count(lang)
+        rows = []
+        for key, joke in new:
+            if count < self.max_size:
+                rows.append({"lang": lang, "digest": key, "text": joke, "slot": count})
+                count += 1
+            else:
+                Joke.update(digest=key, text=joke).where((Joke.lang == lang) &
+                                                         (Joke.slot == random.randrange(self.max_size))).execute()
+        for batch in chunked(rows, INSERT_BATCH):
+            # a concurrent transaction on PostgreSQL may take the same slots or jokes, they're skipped then
+            Joke.insert_many(batch).on_conflict_ignore().execute()
+        self.counts[lang] = self._count(lang) if rows else count
+        return [joke for _, joke in new]
+
+    @staticmethod
+    def _count(lang: str) -> int:
+        top = Joke.select(fn.MAX(Joke.slot)).where(Joke.lang == lang).scalar()
+        return 0 if top is None else top + 1
+
+    def sample(self, lang: str, size: int) -> List[str]:
+        """
+        Random distinct jokes of the lang, fewer if the store doesn't have as many.
+        """
+        count = self.counts.get(lang, 0)
+        if count == 0:
+            return []
+        slots = random.sample(range(count), min(size, count))
+        jokes = [text for text, in Joke.select(Joke.text).where((Joke.lang == lang) & Joke.slot.in_(slots)).tuples()]
+        random.shuffle(jokes)
+        return jokes
+
+    def size(self, lang: str) -> int:
+        return self.counts.get(lang, 0)
+
+
+store = JokeStore(MAX_SIZE)
@@ -0,0 +1,39 @@
+import multiprocessing
+
+from barcounter import bot, log, sharding, startup
+
+logger = log
+
+
+def _run_worker(worker: int, shard_ids, shard_count: int):
+    sharding.own(shard_ids, shard_count)
+    startup.phase("imports")
+    bot.start(shard_ids=shard_ids, shard_count=shard_count, worker=worker)
+
+
+def launch():
+    """
+    Runs the bot in this process, or spawns SHARDING.workers processes with a share of the shards each.
+    The schema must be migrated before.
+    """
+    if sharding.WORKERS <= 1 and sharding.SHARD_COUNT <= 1:
+        bot.start()
+        return
+    bot.setup_logger("-launcher")
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=_run_worker, args=(worker, shard_ids, sharding.SHARD_COUNT),
+                               name="barcounter-worker-{0}".format(worker))
+               for worker, shard_ids in enumerate(sharding.assign_shards())]
+    for process in workers:
+        process.start()
+    logger.info("Started {0} workers for {1} shards".format(len(workers), sharding.SHARD_COUNT))
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        # the workers get the interrupt too and shut down on their own
+        for process in workers:
+            process.join()
+    for process in workers:
+        if process.exitcode:
+            logger.error("{0} exited with code {1}".format(process.name, process.exitcode))
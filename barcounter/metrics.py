@@ -0,0 +1,253 @@
+import asyncio
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+from dynaconf import settings
+
+from barcounter import log
+
+logger = log
+
+ENABLED = settings.METRICS["enabled"]
+HOST = settings.METRICS["host"]
+PORT = settings.METRICS["port"]
+LOG_INTERVAL = settings.METRICS["log_interval"]
+LAG_INTERVAL = 0.5
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+# queries of the running command, propagated to the database threads by dbx
+_command_queries = contextvars.ContextVar("command_queries", default=None)
+
+
+class Counter:
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self.values = dict()
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, value=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def collect(self):
+        yield "# HELP {0} {1}".format(self.name, self.doc)
+        yield "# TYPE {0} counter".format(self.name)
+        with self._lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            yield "{0}{1} {2}".format(self.name, _labels(self.labels, labels), value)
+
+
+class Histogram:
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> [per bucket counts (the last one is +Inf), sum]
+        self.values = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts, total = self.values.get(labels) or ([0] * (len(self.buckets) + 1), 0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[labels] = (counts, total + value)
+
+    def count(self, *labels):
+        counts, _ = self.values.get(labels, ((), 0))
+        return sum(counts)
+
+    def mean(self, *labels):
+        counts, total = self.values.get(labels, ((), 0))
+        return total / sum(counts) if counts else 0
+
+    def collect(self):
+        yield "# HELP {0} {1}".format(self.name, self.doc)
+        yield "# TYPE {0} histogram".format(self.name)
+        with self._lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self.values.items())
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield "{0}_bucket{1} {2}".format(self.name, _labels(self.labels + ("le",), labels + (bound,)),
+                                                 cumulative)
+            yield "{0}_sum{1} {2}".format(self.name, _labels(self.labels, labels), total)
+            yield "{0}_count{1} {2}".format(self.name, _labels(self.labels, labels), cumulative)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join('{0}="{1}"'.format(name, value) for name, value in zip(names, values)) + "}"
+
+
+command_seconds = Histogram("barcounter_command_seconds", "Command latency, serve waits for the answers.",
+                            ("command",))
+command_queries = Histogram("barcounter_command_queries", "SQL statements per command.", ("command",),
+                            buckets=QUERY_BUCKETS)
+command_errors = Counter("barcounter_command_errors_total", "Commands failed with an error.", ("command",))
+db_queries = Counter("barcounter_db_queries_total", "SQL statements, by the command issued them.", ("command",))
+fetch_seconds = Histogram("barcounter_fetch_seconds", "Joke source fetch latency, retries included.", ("source",))
+fetch_failures = Counter("barcounter_fetch_failures_total", "Joke source fetches failed after all retries.",
+                         ("source",))
+job_seconds = Histogram("barcounter_job_seconds", "Duration of the periodic jobs.", ("job",))
+loop_lag_seconds = Histogram("barcounter_loop_lag_seconds", "Event loop lag.")
+command_throttled = Counter("barcounter_command_throttled_total", "Commands rejected by the rate limiter.",
+                            ("command", "scope"))
+portion_conflicts = Counter("barcounter_portion_conflicts_total",
+                            "Portions the database refused while the cached drink still had them.")
+outbox_posted = Counter("barcounter_outbox_posted_total", "Messages posted to the outbox.")
+outbox_sent = Counter("barcounter_outbox_sent_total", "Messages sent by the outbox, after the merging.")
+rate_limit_hits = Counter("barcounter_rate_limit_hits_total", "Discord rate limits hit by the HTTP client.")
+
+METRICS = [command_seconds, command_queries, command_errors, db_queries, fetch_seconds, fetch_failures, job_seconds,
+           loop_lag_seconds, command_throttled, portion_conflicts, outbox_posted, outbox_sent, rate_limit_hits]
+
+
+def _collect_server_cache():
+    # imported here, the cogs import this module
+    from barcounter.cogs.helpers import server_cache_info
+    from barcounter.ratelimit import limiter
+
+    info = server_cache_info()
+    yield "# TYPE barcounter_server_cache_hits_total counter"
+    yield "barcounter_server_cache_hits_total {0}".format(info["hits"])
+    yield "# TYPE barcounter_server_cache_misses_total counter"
+    yield "barcounter_server_cache_misses_total {0}".format(info["misses"])
+    yield "# TYPE barcounter_server_cache_size gauge"
+    yield "barcounter_server_cache_size {0}".format(info["size"])
+    yield "# TYPE barcounter_rate_limit_buckets gauge"
+    yield "barcounter_rate_limit_buckets {0}".format(limiter.size())
+
+
+def render() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.collect())
+    lines.extend(_collect_server_cache())
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def timed(histogram, *labels):
+    """
+    Observes the duration of the block in the histogram.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started, *labels)
+
+
+def _instrument_database(db):
+    execute_sql = db.execute_sql
+
+    def counting(*args, **kwargs):
+        queries = _command_queries.get()
+        if queries is None:
+            db_queries.inc("")
+        else:
+            queries[1] += 1
+            db_queries.inc(queries[0])
+        return execute_sql(*args, **kwargs)
+
+    db.execute_sql = counting
+
+
+async def _before_invoke(ctx):
+    ctx.metrics_started = time.perf_counter()
+    _command_queries.set([ctx.command.qualified_name, 0])
+
+
+async def _after_invoke(ctx):
+    name = ctx.command.qualified_name
+    command_seconds.observe(time.perf_counter() - ctx.metrics_started, name)
+    queries = _command_queries.get()
+    if queries is not None:
+        command_queries.observe(queries[1], name)
+    if ctx.command_failed:
+        command_errors.inc(name)
+
+
+class _RateLimitHandler(logging.Handler):
+    def emit(self, record):
+        if isinstance(record.msg, str) and record.msg.startswith("We are being rate limited"):
+            rate_limit_hits.inc()
+
+
+async def _lag_loop():
+    loop = asyncio.get_event_loop()
+    while True:
+        expected = loop.time() + LAG_INTERVAL
+        await asyncio.sleep(LAG_INTERVAL)
+        loop_lag_seconds.observe(max(0.0, loop.time() - expected))
+
+
+def summary() -> str:
+    commands = ", ".join("{0} {1}x {2:.1f}ms {3:.1f}q".format(labels[0], command_seconds.count(*labels),
+                                                             command_seconds.mean(*labels) * 1000,
+                                                             command_queries.mean(*labels))
+                         for labels in sorted(command_seconds.values))
+    return "Metrics: commands: {0}; loop lag {1:.1f}ms avg; rate limits {2}".format(
+        commands or "none", loop_lag_seconds.mean() * 1000, rate_limit_hits.values.get((), 0))
+
+
+async def _log_loop():
+    while True:
+        await asyncio.sleep(LOG_INTERVAL)
+        logger.info(summary())
+
+
+async def _handle(request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+_tasks = []
+_runner = None
+
+
+async def start(bot, db, worker=None):
+    """
+    Instruments the bot and the database, serves the metrics on METRICS.host:port/metrics
+    (the port is shifted by the number of the worker) and dumps a summary to the log every METRICS.log_interval
+    seconds, if it's not 0. Does nothing unless METRICS.enabled.
+    """
+    global _runner
+    if not ENABLED or _runner is not None:
+        return
+    _instrument_database(db)
+    bot.before_invoke(_before_invoke)
+    bot.after_invoke(_after_invoke)
+    logging.getLogger("discord.http").addHandler(_RateLimitHandler())
+    _tasks.append(asyncio.ensure_future(_lag_loop()))
+    if LOG_INTERVAL > 0:
+        _tasks.append(asyncio.ensure_future(_log_loop()))
+    app = web.Application()
+    app.router.add_get("/metrics", _handle)
+    _runner = web.AppRunner(app)
+    await _runner.setup()
+    port = PORT + (worker or 0)
+    await web.TCPSite(_runner, HOST, port).start()
+    logger.info("Serving metrics on {0}:{1}/metrics".format(HOST, port))
+
+
+async def stop():
+    global _runner
+    for task in _tasks:
+        task.cancel()
+    _tasks.clear()
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,169 @@
+import time
+from contextlib import contextmanager
+
+from peewee import BigIntegerField, IntegerField, CharField, SqliteDatabase, fn
+from playhouse.migrate import SchemaMigrator, SqliteMigrator, migrate as run
+
+from barcounter import db, log
+from barcounter.dbentities import Server, Person, Drink, PendingServe, Joke, SchemaVersion, drink_key
+
+logger = log
+
+MODELS = [Server, Person, Drink, PendingServe, Joke, SchemaVersion]
+
+
+def _add_person_intoxication_updated(migrator):
+    run(migrator.add_column("person", "intoxication_updated", IntegerField(default=int(time.time()))))
+
+
+def _add_lazy_restock(migrator):
+    run(migrator.add_column("drink", "restocked_at", IntegerField(default=int(time.time()))),
+        migrator.add_column("server", "timezone", CharField(default="UTC")),
+        migrator.add_column("server", "restock_time", IntegerField(default=0)))
+
+
+def _deduplicate(model, *fields):
+    keep = model.select(fn.MIN(model.id)).group_by(*fields)
+    deleted = model.delete().where(model.id.not_in(keep)).execute()
+    if deleted:
+        logger.warning("Removed {0} duplicated rows of {1}".format(deleted, model.__name__))
+
+
+def _add_unique_indexes(migrator):
+    duplicated_servers = (Server.select(Server.sid, fn.MIN(Server.id))
+                          .group_by(Server.sid)
+                          .having(fn.COUNT(Server.id) > 1))
+    for sid, keeper in duplicated_servers.tuples():
+        duplicates = Server.select(Server.id).where((Server.sid == sid) & (Server.id != keeper))
+        Person.update(server=keeper).where(Person.server.in_(duplicates)).execute()
+        Drink.update(server=keeper).where(Drink.server.in_(duplicates)).execute()
+    _deduplicate(Server, Server.sid)
+    _deduplicate(Person, Person.server, Person.uid)
+    _deduplicate(Drink, Drink.server, Drink.name)
+    run(migrator.add_index("server", ("sid",), True),
+        migrator.add_index("person", ("server_id", "uid"), True),
+        migrator.add_index("drink", ("server_id", "name"), True))
+
+
+def _add_drink_name_key(migrator):
+    run(migrator.add_column("drink", "name_key", CharField(default="")))
+    for drink_id, name in Drink.select(Drink.id, Drink.name).tuples():
+        Drink.update(name_key=drink_key(name)).where(Drink.id == drink_id).execute()
+    run(migrator.add_index("drink", ("server_id", "name_key"), False))
+
+
+def _add_pending_serve(migrator):
+    migrator.database.create_tables([PendingServe])
+
+
+def _rebuild_table(database, model):
+    """
+    Recreates the table of the model from its current definition, SQLite can't alter the constraints.
+    """
+    table = model._meta.table_name
+    old = table + "_old"
+    database.execute_sql('ALTER TABLE "{0}" RENAME TO "{1}"'.format(table, old))
+    # the indexes moved with the table, but keep their names
+    for index in database.get_indexes(old):
+        if index.sql:
+            database.execute_sql('DROP INDEX "{0}"'.format(index.name))
+    database.create_tables([model])
+    old_columns = {column.name for column in database.get_columns(old)}
+    columns = ", ".join('"{0}"'.format(field.column_name) for field in model._meta.sorted_fields
+                        if field.column_name in old_columns)
+    database.execute_sql('INSERT INTO "{0}" ({1}) SELECT {1} FROM "{2}"'.format(table, columns, old))
+    database.execute_sql('DROP TABLE "{0}"'.format(old))
+
+
+def _cascade_server_deletes(migrator):
+    database = migrator.database
+    for model in (Person, Drink):
+        deleted = model.delete().where(model.server.not_in(Server.select(Server.id))).execute()
+        if deleted:
+            logger.warning("Removed {0} rows of {1} without a server".format(deleted, model.__name__))
+        table = model._meta.table_name
+        if isinstance(migrator, SqliteMigrator):
+            _rebuild_table(database, model)
+            continue
+        constraints = database.execute_sql("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass "
+                                           "AND contype = 'f'", (table,)).fetchall()
+        for (name,) in constraints:
+            database.execute_sql('ALTER TABLE "{0}" DROP CONSTRAINT "{1}"'.format(table, name))
+        run(migrator.add_foreign_key_constraint(table, "server_id", "server", "id", on_delete="CASCADE"))
+
+
+def _add_joke_store(migrator):
+    migrator.database.create_tables([Joke])
+
+
+def _widen_timestamps(migrator):
+    # an SQLite INTEGER already takes up to 8 bytes, a PostgreSQL integer overflows in 2038
+    if isinstance(migrator.database, SqliteDatabase):
+        return
+    run(migrator.alter_column_type("person", "intoxication_updated", BigIntegerField()),
+        migrator.alter_column_type("drink", "restocked_at", BigIntegerField()),
+        migrator.alter_column_type("pendingserve", "deadline", BigIntegerField()))
+
+
+# Append only: the index of a migration is the schema version it upgrades from.
+MIGRATIONS = [
+    _add_person_intoxication_updated,
+    _add_lazy_restock,
+    _add_unique_indexes,
+    _add_drink_name_key,
+    _add_pending_serve,
+    _cascade_server_deletes,
+    _add_joke_store,
+    _widen_timestamps,
+]
+
+
+def migrate(database=db):
+    """
+    Creates the tables on a fresh database, otherwise applies the pending migrations.
+    An up to date database is only read. Must not run inside a transaction, SQLite foreign keys are switched off
+    while migrating.
+    """
+    with database.bind_ctx(MODELS):
+        _migrate(database)
+
+
+@contextmanager
+def _foreign_keys_off(database):
+    """
+    SQLite migrations copy the tables around, the foreign keys are checked once they're done.
+    The pragma is a no-op inside a transaction, so it wraps the whole migration.
+    """
+    if not isinstance(database, SqliteDatabase) or not database.foreign_keys:
+        yield
+        return
+    database.foreign_keys = 0
+    try:
+        yield
+        violations = database.execute_sql("PRAGMA foreign_key_check").fetchall()
+        if violations:
+            logger.warning("Foreign key violations after the migration: {0}".format(violations))
+    finally:
+        database.foreign_keys = 1
+
+
+def _migrate(database):
+    if SchemaVersion.table_exists():
+        schema = SchemaVersion.get_or_none()
+        if schema is not None and schema.version == len(MIGRATIONS):
+            logger.info("Schema version {0} is up to date".format(schema.version))
+            return
+    with _foreign_keys_off(database), database.atomic():
+        if not Server.table_exists():
+            database.create_tables(MODELS)
+            SchemaVersion.create(version=len(MIGRATIONS))
+            logger.info("Created tables, schema version {0}".format(len(MIGRATIONS)))
+            return
+        database.create_tables([SchemaVersion])
+        schema = SchemaVersion.get_or_none() or SchemaVersion.create(version=0)
+        migrator = SchemaMigrator.from_database(database)
+        for version in range(schema.version, len(MIGRATIONS)):
+            logger.info("Migrating schema from version {0}".format(version))
+            MIGRATIONS[version](migrator)
+        schema.version = len(MIGRATIONS)
+        schema.save()
@@ -0,0 +1,167 @@
+import asyncio
+import time
+
+from discord import HTTPException
+from dynaconf import settings
+
+from barcounter import log, metrics
+from barcounter.ratelimit import Buckets, SWEEP_INTERVAL
+
+logger = log
+
+MESSAGE_LIMIT = 2000
+WINDOW = settings.OUTBOX["window"]
+# Discord lets a channel take 5 messages per 5 seconds
+CHANNEL_RATE = settings.OUTBOX["channel_rate"]
+CHANNEL_PER = settings.OUTBOX["channel_per"]
+
+
+def pack(parts):
+    """
+    Joins the parts with new lines into as few messages within MESSAGE_LIMIT as possible, keeping their order.
+
+    :return: list of (text, number of the parts it ends)
+    """
+    messages = []
+    text, count = None, 0
+    for part in parts:
+        # a single oversized part is split, it's the only way to send it
+        chunks = [part[i:i + MESSAGE_LIMIT] for i in range(0, len(part), MESSAGE_LIMIT)] or [part]
+        for n, chunk in enumerate(chunks):
+            if text is not None and len(text) + 1 + len(chunk) <= MESSAGE_LIMIT:
+                text += "\n" + chunk
+            else:
+                if text is not None:
+                    messages.append((text, count))
+                text, count = chunk, 0
+            if n == len(chunks) - 1:
+                count += 1
+    if text is not None:
+        messages.append((text, count))
+    return messages
+
+
+def _wake(timer):
+    if not timer.done():
+        timer.set_result(None)
+
+
+class _ChannelQueue:
+    __slots__ = ("channel", "parts", "futures", "task", "timer")
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.parts = []
+        self.futures = []
+        self.task = None
+        # resolved early by the flush
+        self.timer = None
+
+
+class Outbox:
+    """
+    Outgoing messages per channel. The messages posted within WINDOW seconds are merged into one send,
+    the sends to a channel are paced by a token bucket of CHANNEL_RATE messages per CHANNEL_PER seconds.
+    The messages posted while a channel waits for its bucket are merged as well.
+    """
+
+    def __init__(self):
+        self.queues = dict()
+        self.pacing = Buckets(CHANNEL_RATE, CHANNEL_PER)
+        self.flushing = False
+        self._swept = time.monotonic()
+
+    def post(self, channel, content: str) -> asyncio.Future:
+        """
+        Queues the message to the channel.
+
+        :return: future of the sent message that includes the content, None if sending failed
+        """
+        queue = self.queues.get(channel.id)
+        if queue is None:
+            queue = self.queues[channel.id] = _ChannelQueue(channel)
+        future = asyncio.get_event_loop().create_future()
+        queue.parts.append(content)
+        queue.futures.append(future)
+        metrics.outbox_posted.inc()
+        now = time.monotonic()
+        if now - self._swept >= SWEEP_INTERVAL:
+            self._swept = now
+            self.pacing.sweep(now)
+        if queue.task is None:
+            queue.task = asyncio.ensure_future(self._drain(queue))
+        return future
+
+    async def _drain(self, queue: _ChannelQueue):
+        futures = []
+        try:
+            await self._wait(queue, WINDOW)
+            while queue.parts:
+                await self._pace(queue)
+                parts, futures = queue.parts, queue.futures
+                queue.parts, queue.futures = [], []
+                await self._send(queue.channel, parts, futures)
+        finally:
+            # a failed or cancelled drain must not leave the channel without one, the next post starts it
+            del self.queues[queue.channel.id]
+            # the parts of the failed send and the ones queued after it, their posters get None as for a failed send
+            dropped = [future for future in futures + queue.futures if not future.done()]
+            if dropped:
+                logger.warning("Dropped {0} messages to {1}".format(len(dropped), queue.channel.id))
+            for future in dropped:
+                future.set_result(None)
+
+    async def _wait(self, queue: _ChannelQueue, delay: float):
+        if self.flushing:
+            return
+        loop = asyncio.get_event_loop()
+        queue.timer = loop.create_future()
+        handle = loop.call_later(delay, _wake, queue.timer)
+        try:
+            await queue.timer
+        finally:
+            handle.cancel()
+            queue.timer = None
+
+    async def _pace(self, queue: _ChannelQueue):
+        channel_id = queue.channel.id
+        while not self.flushing:
+            now = time.monotonic()
+            tokens, _ = self.pacing.tokens(channel_id, now)
+            if tokens >= 1:
+                self.pacing.buckets[channel_id] = (tokens - 1, now, False)
+                return
+            await self._wait(queue, (1 - tokens) / self.pacing.refill)
+
+    @staticmethod
+    async def _send(channel, parts, futures):
+        done = 0
+        for text, count in pack(parts):
+            try:
+                message = await channel.send(text)
+            except HTTPException:
+                logger.info("Can't send a message to {0}".format(channel.id))
+                message = None
+            metrics.outbox_sent.inc()
+            for future in futures[done:done + count]:
+                if not future.done():
+                    future.set_result(message)
+            done += count
+
+    async def flush(self):
+        """
+        Sends everything queued right away, skipping the window and the pacing.
+        """
+        self.flushing = True
+        try:
+            tasks = []
+            for queue in list(self.queues.values()):
+                if queue.timer is not None:
+                    _wake(queue.timer)
+                tasks.append(queue.task)
+            await asyncio.gather(*tasks)
+        finally:
+            self.flushing = False
+
+
+outbox = Outbox()
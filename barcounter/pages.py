@@ -0,0 +1,200 @@
+import asyncio
+from collections import OrderedDict
+
+from discord import HTTPException, Object
+from dynaconf import settings
+
+from barcounter import confutils as conf, log
+from barcounter.cogs.helpers import get_server_or_create
+from barcounter.dbentities import Drink, Server
+from barcounter.dbexecutor import dbx
+from barcounter.serveregistry import TimerWheel, WHEEL_SLOTS
+from barcounter.state import engine
+
+logger = log
+
+MESSAGE_LIMIT = 2000
+# room for the page footer
+FOOTER_LENGTH = 50
+PAGE_SIZE = settings.LIST["page_size"]
+LIST_TIMEOUT = settings.LIST["timeout"]
+CACHED_SERVERS = settings.LIST["cached_servers"]
+PREV_EMOJI = "◀️"
+NEXT_EMOJI = "▶️"
+
+
+class PageCache:
+    """
+    Rendered pages of ?list per server, keyed by the drink name the page starts after.
+
+    The pages of a server are dropped on any change of its drinks, on a change of its lang
+    and when a new daily restock moment has passed. Up to CACHED_SERVERS servers are kept, the least recently used
+    one is evicted first.
+    """
+
+    def __init__(self, max_servers: int):
+        self.max_servers = max_servers
+        self.servers = OrderedDict()
+        # bumped by every invalidation, a page rendered from an older state is not stored
+        self.version = 0
+
+    def get(self, server_id: int, stamp, after: str):
+        entry = self.servers.get(server_id)
+        if entry is None or entry[0] != stamp:
+            return None
+        self.servers.move_to_end(server_id)
+        return entry[1].get(after)
+
+    def put(self, server_id: int, stamp, after: str, page, version: int):
+        if version != self.version:
+            return
+        entry = self.servers.get(server_id)
+        if entry is None or entry[0] != stamp:
+            entry = self.servers[server_id] = (stamp, dict())
+        entry[1][after] = page
+        self.servers.move_to_end(server_id)
+        while len(self.servers) > self.max_servers:
+            self.servers.popitem(last=False)
+
+    def invalidate(self, server_id: int):
+        self.version += 1
+        self.servers.pop(server_id, None)
+
+
+cache = PageCache(CACHED_SERVERS)
+
+
+def invalidate(server_id: int):
+    cache.invalidate(server_id)
+
+
+def _load_page(server: Server, after: str):
+    return list(Drink.select()
+                .where((Drink.server == server) & (Drink.name > after))
+                .order_by(Drink.name)
+                .limit(PAGE_SIZE + 1))
+
+
+def _render(server: Server, drinks):
+    """
+    :return: text of the page and the name the next page starts after, None if it's the last page
+    """
+    lines = []
+    length = 0
+    for drink in drinks[:PAGE_SIZE]:
+        # the cached instance is ahead of the database
+        drink = engine.drinks.get((server.sid, drink.name), drink)
+        line = conf.lang(server.lang, "drink_info").format(drink.name, drink.portion_size, drink.portions_left,
+                                                          drink.portions_per_day)
+        if lines and length + len(line) + 1 > MESSAGE_LIMIT - FOOTER_LENGTH:
+            break
+        lines.append(line)
+        length += len(line) + 1
+    has_next = len(lines) < len(drinks)
+    return "\n".join(lines), (drinks[len(lines) - 1].name if has_next else None)
+
+
+async def get_page(server: Server, after: str = ""):
+    """
+    Keyset-paginated page of the drinks of the server ordered by name, from the cache if possible.
+
+    :return: text of the page, empty if there are no drinks, and the name the next page starts after or None
+    """
+    stamp = (server.lang, server.last_restock())
+    page = cache.get(server.id, stamp, after)
+    if page is None:
+        version = cache.version
+        page = _render(server, await dbx.read(_load_page, server, after))
+        cache.put(server.id, stamp, after, page, version)
+    return page
+
+
+def with_footer(lang: str, text: str, index: int) -> str:
+    return text + "\n" + conf.lang(lang, "list_page").format(index + 1)
+
+
+class PageSession:
+    __slots__ = ("message", "guild", "cursors", "index", "turning")
+
+    def __init__(self, message, guild, cursors):
+        self.message = message
+        self.guild = guild
+        # names the pages start after, the next one is appended when it's known
+        self.cursors = cursors
+        self.index = 0
+        self.turning = False
+
+
+class PageRegistry:
+    """
+    ?list messages with more than one page, keyed by the message id.
+    The pages are turned by the reactions, a message is forgotten after LIST_TIMEOUT seconds without turns.
+    """
+
+    def __init__(self):
+        self.sessions = dict()
+        self.wheel = TimerWheel(WHEEL_SLOTS)
+        self._ticker = None
+
+    def register(self, session: PageSession):
+        self.sessions[session.message.id] = session
+        self.wheel.schedule(session.message.id, LIST_TIMEOUT)
+
+    def dispatch(self, message_id: int, user_id: int, emoji: str) -> bool:
+        """
+        :return: True, if the reaction turns a page
+        """
+        session = self.sessions.get(message_id)
+        if session is None or emoji not in (PREV_EMOJI, NEXT_EMOJI):
+            return False
+        self.wheel.schedule(message_id, LIST_TIMEOUT)
+        asyncio.ensure_future(self._turn(session, -1 if emoji == PREV_EMOJI else 1, user_id, emoji))
+        return True
+
+    @staticmethod
+    async def _turn(session: PageSession, step: int, user_id: int, emoji: str):
+        index = session.index + step
+        if not session.turning and 0 <= index < len(session.cursors):
+            session.turning = True
+            try:
+                server = await get_server_or_create(session.guild.id, session.guild.preferred_locale)
+                text, next_after = await get_page(server, session.cursors[index])
+                if next_after is not None and index + 1 == len(session.cursors):
+                    session.cursors.append(next_after)
+                session.index = index
+                await session.message.edit(content=with_footer(server.lang, text, index))
+            except HTTPException:
+                logger.info("Can't turn the page of {0} on {1}".format(session.message.id, session.guild.id))
+            finally:
+                session.turning = False
+        try:
+            await session.message.remove_reaction(emoji, Object(id=user_id))
+        except HTTPException:
+            pass
+
+    @staticmethod
+    async def _expire(session: PageSession):
+        try:
+            await session.message.clear_reactions()
+        except HTTPException:
+            pass
+
+    async def _tick_loop(self):
+        while True:
+            await asyncio.sleep(1)
+            for message_id in self.wheel.tick():
+                session = self.sessions.pop(message_id, None)
+                if session is not None:
+                    asyncio.ensure_future(self._expire(session))
+
+    def start(self, loop):
+        if self._ticker is None:
+            self._ticker = loop.create_task(self._tick_loop())
+
+    def stop(self):
+        if self._ticker is not None:
+            self._ticker.cancel()
+            self._ticker = None
+
+
+page_registry = PageRegistry()
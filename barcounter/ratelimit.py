@@ -0,0 +1,93 @@
+import time
+
+from discord.ext import commands
+
+from barcounter import confutils as conf
+
+SCOPES = ("guild", "user")
+DEFAULT = "default"
+# full buckets are dropped at most that often
+SWEEP_INTERVAL = 60
+
+
+class RateLimited(commands.CheckFailure):
+    def __init__(self, command: str, scope: str, retry_after: float, notify: bool):
+        super().__init__("Command {0} is rate limited per {1} for {2:.1f}s".format(command, scope, retry_after))
+        self.command = command
+        self.scope = scope
+        self.retry_after = retry_after
+        # False, if the author was already told to wait in this window
+        self.notify = notify
+
+
+class Buckets:
+    """
+    Token buckets of one command and scope, keyed by the guild or the user id.
+    A bucket holds up to rate tokens and regains them in per seconds. It's kept as a (tokens, updated, notified)
+    tuple only while it's not full, a missing bucket is a full one.
+    """
+    __slots__ = ("capacity", "refill", "mention_cost", "buckets")
+
+    def __init__(self, rate: int, per: float, mention_cost: float = 0):
+        self.capacity = rate
+        self.refill = rate / per
+        self.mention_cost = mention_cost
+        self.buckets = dict()
+
+    def cost(self, mentions: int) -> float:
+        # a command can always pass with a full bucket
+        return min(self.capacity, 1 + self.mention_cost * mentions)
+
+    def tokens(self, key: int, now: float):
+        tokens, updated, notified = self.buckets.get(key, (self.capacity, now, False))
+        return min(self.capacity, tokens + (now - updated) * self.refill), notified
+
+    def sweep(self, now: float):
+        full = [key for key, (tokens, updated, _) in self.buckets.items()
+                if tokens + (now - updated) * self.refill >= self.capacity]
+        for key in full:
+            del self.buckets[key]
+
+
+class RateLimiter:
+    def __init__(self, limits):
+        self.commands = dict()
+        for command, scopes in limits.items():
+            self.commands[command] = [(scope, Buckets(scopes[scope]["rate"], scopes[scope]["per"],
+                                                      scopes[scope].get("mention_cost", 0)))
+                                      for scope in SCOPES if scope in scopes]
+        self._swept = time.monotonic()
+
+    def acquire(self, command: str, guild_id: int, user_id: int, mentions: int = 0):
+        """
+        Takes the tokens of the command from the guild and the user buckets, either from both or from none.
+
+        :raise RateLimited: if one of the buckets doesn't have enough tokens
+        """
+        now = time.monotonic()
+        if now - self._swept >= SWEEP_INTERVAL:
+            self.sweep(now)
+        limits = self.commands.get(command, self.commands.get(DEFAULT, ()))
+        taken = []
+        for scope, buckets in limits:
+            key = guild_id if scope == "guild" else user_id
+            cost = buckets.cost(mentions)
+            tokens, notified = buckets.tokens(key, now)
+            if tokens < cost:
+                buckets.buckets[key] = (tokens, now, True)
+                raise RateLimited(command, scope, (cost - tokens) / buckets.refill, not notified)
+            taken.append((buckets, key, tokens - cost))
+        for buckets, key, tokens in taken:
+            buckets.buckets[key] = (tokens, now, False)
+
+    def sweep(self, now: float):
+        self._swept = now
+        for limits in self.commands.values():
+            for _, buckets in limits:
+                buckets.sweep(now)
+
+    def size(self) -> int:
+        return sum(len(buckets.buckets) for limits in self.commands.values() for _, buckets in limits)
+
+
+limiter = RateLimiter(conf.limitation("rate_limits"))
@@ -0,0 +1,150 @@
+import asyncio
+import math
+import time
+
+from dynaconf import settings
+
+from barcounter import log
+from barcounter.dbentities import PendingServe
+from barcounter.dbexecutor import dbx
+
+logger = log
+
+SERVE_TIMEOUT = settings.LIMITATIONS["serve_timeout"]
+PERSIST = settings.SERVE["persist"]
+WHEEL_SLOTS = 1024
+
+# put into the queue of the serve when nobody answered for SERVE_TIMEOUT seconds
+EXPIRED = None
+
+
+class TimerWheel:
+    """
+    Hashed timing wheel with one-second slots: scheduling, cancelling and expiring a key are O(1).
+    """
+
+    def __init__(self, slots: int):
+        self.slots = [dict() for _ in range(slots)]
+        self.position = 0
+        self._slot_of = dict()
+
+    def schedule(self, key, delay: float):
+        self.cancel(key)
+        ticks = max(1, math.ceil(delay))
+        rounds, offset = divmod(ticks, len(self.slots))
+        slot = (self.position + offset) % len(self.slots)
+        if offset == 0:
+            rounds -= 1
+        self.slots[slot][key] = rounds
+        self._slot_of[key] = slot
+
+    def cancel(self, key):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            del self.slots[slot][key]
+
+    def tick(self):
+        """
+        Advances the wheel by one second and returns the expired keys.
+        """
+        self.position = (self.position + 1) % len(self.slots)
+        slot = self.slots[self.position]
+        expired = [key for key, rounds in slot.items() if rounds == 0]
+        for key in expired:
+            del slot[key]
+            del self._slot_of[key]
+        for key in slot:
+            slot[key] -= 1
+        return expired
+
+
+class ServeEntry:
+    __slots__ = ("message_id", "channel_id", "guild_id", "author_id", "drink_name", "expected", "ok_emoji",
+                 "no_emoji", "queue")
+
+    def __init__(self, message_id, channel_id, guild_id, author_id, drink_name, expected, ok_emoji, no_emoji):
+        self.message_id = message_id
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.author_id = author_id
+        self.drink_name = drink_name
+        self.expected = set(expected)
+        self.ok_emoji = ok_emoji
+        self.no_emoji = no_emoji
+        self.queue = asyncio.Queue()
+
+
+class ServeRegistry:
+    """
+    Pending serves keyed by the id of the serve message.
+
+    Reactions are dispatched to the queue of their serve in O(1), the answers are
+    consumed by the serve session. A serve expires when nobody answered for SERVE_TIMEOUT seconds.
+    With SERVE.persist, pending serves are stored in the database to be restored after a restart.
+    """
+
+    def __init__(self):
+        self.entries = dict()
+        self.wheel = TimerWheel(WHEEL_SLOTS)
+        self._ticker = None
+
+    async def register(self, entry: ServeEntry, timeout: float = SERVE_TIMEOUT):
+        self.entries[entry.message_id] = entry
+        self.wheel.schedule(entry.message_id, timeout)
+        if PERSIST:
+            await dbx.write(PendingServe.insert(
+                message_id=entry.message_id, channel_id=entry.channel_id, guild_id=entry.guild_id,
+                author_id=entry.author_id, drink_name=entry.drink_name,
+                expected=" ".join(map(str, entry.expected)), deadline=self._deadline(timeout)
+            ).on_conflict(conflict_target=[PendingServe.message_id],
+                          preserve=[PendingServe.expected, PendingServe.deadline]).execute)
+
+    async def unregister(self, message_id: int):
+        self.wheel.cancel(message_id)
+        if self.entries.pop(message_id, None) is not None and PERSIST:
+            await dbx.write(PendingServe.delete().where(PendingServe.message_id == message_id).execute)
+
+    def dispatch(self, message_id: int, user_id: int, emoji: str) -> bool:
+        """
+        :return: True, if the reaction is an answer to a pending serve
+        """
+        entry = self.entries.get(message_id)
+        if entry is None or user_id not in entry.expected or emoji not in (entry.ok_emoji, entry.no_emoji):
+            return False
+        entry.expected.remove(user_id)
+        entry.queue.put_nowait((user_id, emoji == entry.ok_emoji))
+        self.wheel.schedule(message_id, SERVE_TIMEOUT)
+        if PERSIST:
+            asyncio.ensure_future(dbx.write(
+                PendingServe.update(expected=" ".join(map(str, entry.expected)), deadline=self._deadline())
+                .where(PendingServe.message_id == message_id).execute
+            ))
+        return True
+
+    @staticmethod
+    def _deadline(timeout: float = SERVE_TIMEOUT) -> int:
+        return int(time.time() + timeout)
+
+    @staticmethod
+    async def load_persisted():
+        return await dbx.read(list, PendingServe.select())
+
+    async def _tick_loop(self):
+        while True:
+            await asyncio.sleep(1)
+            for message_id in self.wheel.tick():
+                entry = self.entries.get(message_id)
+                if entry is not None:
+                    entry.queue.put_nowait(EXPIRED)
+
+    def start(self, loop):
+        if self._ticker is None:
+            self._ticker = loop.create_task(self._tick_loop())
+
+    def stop(self):
+        if self._ticker is not None:
+            self._ticker.cancel()
+            self._ticker = None
+
+
+registry = ServeRegistry()
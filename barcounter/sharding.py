@@ -0,0 +1,39 @@
+from typing import List
+
+from dynaconf import settings
+
+WORKERS = settings.SHARDING["workers"]
+SHARD_COUNT = settings.SHARDING["shard_count"] or WORKERS
+
+# shards of this process and the total shard count, None if it runs every shard
+_owned = None
+
+
+def shard_of(guild_id: int, shard_count: int = SHARD_COUNT) -> int:
+    """
+    Shard which receives the events of the guild, as computed by Discord.
+    """
+    return (guild_id >> 22) % shard_count
+
+
+def assign_shards(shard_count: int = SHARD_COUNT, workers: int = WORKERS) -> List[List[int]]:
+    """
+    Deals the shards out to the workers round-robin.
+    """
+    workers = min(workers, shard_count)
+    return [list(range(n, shard_count, workers)) for n in range(workers)]
+
+
+def own(shard_ids: List[int], shard_count: int):
+    global _owned
+    _owned = (frozenset(shard_ids), shard_count)
+
+
+def owns(guild_id: int) -> bool:
+    """
+    Guild state (cached rows, pending serves) is only touched by the process owning the shard of the guild.
+    """
+    if _owned is None:
+        return True
+    shard_ids, shard_count = _owned
+    return shard_of(guild_id, shard_count) in shard_ids
@@ -0,0 +1,31 @@
+import logging
+import time
+
+# imported first by the package, so the imports of the dependencies are measured too
+_started = time.perf_counter()
+_last = _started
+_phases = []
+_reported = False
+
+
+def phase(name):
+    """
+    Closes the startup phase that ran since the previous call.
+    """
+    global _last
+    now = time.perf_counter()
+    _phases.append((name, now - _last))
+    _last = now
+
+
+def report():
+    """
+    Logs the startup phases once, on the first on_ready.
+    """
+    global _reported
+    if _reported:
+        return
+    _reported = True
+    phase("gateway")
+    breakdown = ", ".join("{0} {1:.3f}s".format(name, duration) for name, duration in _phases)
+    logging.getLogger('barcounter').info("Started in {0:.3f}s: {1}".format(_last - _started, breakdown))
@@ -0,0 +1,292 @@
+import asyncio
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import List
+
+from dynaconf import settings
+
+from barcounter import db, log, metrics
+from barcounter.dbentities import Person, Drink, DoesNotExist, drink_key
+from barcounter.dbexecutor import dbx
+
+logger = log
+
+FLUSH_INTERVAL = settings.STATE["flush_interval"]
+MAX_CACHED = settings.STATE["max_cached"]
+# upper bound for the prefix range scan over Drink.name_key
+MAX_CHAR = chr(0x10FFFF)
+# one statement for every dose, built once
+_DECAYED = 'intoxication - ({0} - intoxication_updated) / 60'.format(db.param)
+DOSE_SQL = ('UPDATE "{0}" SET intoxication = CASE WHEN {1} > 100 THEN {2} WHEN {1} >= {2} THEN 0 '
+            'WHEN {1} > 0 THEN {1} + {2} ELSE {2} END, intoxication_updated = {2} WHERE id = {2}'
+            ).format(Person._meta.table_name, _DECAYED, db.param)
+
+
+class StateEngine:
+    """
+    In-memory copy of the Person and Drink rows touched by commands.
+
+    The portions are taken from the database right away by a conditional UPDATE, so a drink is never sold twice,
+    even with several processes on one database. The takes of concurrent commands share a transaction.
+    The intoxication doses are recorded and written as increments in one transaction every FLUSH_INTERVAL seconds
+    and on shutdown, so a flush never overwrites what another writer did to the rows in the meantime.
+    Up to MAX_CACHED persons and drinks are kept, a flush drops the least recently used ones beyond that
+    which have no doses or takes waiting.
+    The instances are touched only from the event loop, the database only through dbx.
+    """
+
+    def __init__(self):
+        # (server sid, uid) -> person, (server sid, drink name) -> drink, the least recently used first
+        self.persons = OrderedDict()
+        self.drinks = OrderedDict()
+        # person -> [(intoxication of the drink, unix time)] not written yet
+        self.doses = dict()
+        # drink -> [(portions wanted, future of the portions granted)] waiting for the next take transaction
+        self._takes = dict()
+        self._taker = None
+        # server id -> the restock moment its drinks were last checked against
+        self.restock_checked = dict()
+        self._flusher = None
+        self._writing = None
+
+    async def get_person(self, server, uid) -> Person:
+        return (await self.get_persons(server, [uid]))[0]
+
+    async def get_persons(self, server, uids) -> List[Person]:
+        """
+        Returns the persons of the server in the order of uids.
+        The missing ones are loaded or created in one transaction.
+        """
+        missing = [uid for uid in uids if (server.sid, uid) not in self.persons]
+        if missing:
+            for person in await dbx.write(self._load_persons, server, missing):
+                self.persons.setdefault((server.sid, person.uid), person)
+        return [self._touch(self.persons, (server.sid, uid)) for uid in uids]
+
+    @staticmethod
+    def _load_persons(server, uids):
+        query = Person.select().where((Person.server == server) & (Person.uid.in_(uids)))
+        new = set(uids) - {person.uid for person in query}
+        if new:
+            Person.insert_many([{"server": server, "uid": uid, "intoxication": 0} for uid in new]).execute()
+        return list(query.clone())
+
+    async def get_drink(self, server, name, exact: bool = False) -> Drink:
+        """
+        Resolves the drink of the server by exact name, then case-insensitively, then by an unambiguous prefix
+        unless exact is set, as it is for the commands destroying the drink.
+        The drink is restocked if the daily restock moment of the server has passed since the last restock.
+
+        :raise DoesNotExist: there's no such drink on the server
+        """
+        drink = self.drinks.get((server.sid, name))
+        if drink is None:
+            loaded = await dbx.read(self._resolve_drink, server, name, exact)
+            drink = self.drinks.setdefault((server.sid, loaded.name), loaded)
+        self.drinks.move_to_end((server.sid, drink.name))
+        last_restock = server.last_restock()
+        if drink.restocked_at < last_restock:
+            await self.restock(drink, last_restock)
+        return drink
+
+    @staticmethod
+    def _resolve_drink(server, name, exact: bool = False) -> Drink:
+        key = drink_key(name)
+        in_server = Drink.select().where(Drink.server == server)
+        drink = in_server.where(Drink.name_key == key).order_by((Drink.name == name).desc()).first()
+        if drink is None and exact:
+            raise DoesNotExist("Drink {0} not found on {1}".format(name, server.sid))
+        if drink is None:
+            candidates = list(in_server
+                              .where((Drink.name_key > key) & (Drink.name_key < key + MAX_CHAR))
+                              .order_by(Drink.name_key)
+                              .limit(2))
+            if len(candidates) != 1:
+                raise DoesNotExist("Drink {0} not found on {1}".format(name, server.sid))
+            drink = candidates[0]
+        return drink
+
+    @staticmethod
+    def _touch(cache, key):
+        cache.move_to_end(key)
+        return cache[key]
+
+    def put_drink(self, server, drink: Drink):
+        self.drinks[(server.sid, drink.name)] = drink
+        self.drinks.move_to_end((server.sid, drink.name))
+
+    async def take_portions(self, drink: Drink, count: int = 1) -> int:
+        """
+        Takes up to count portions of the drink in the database, the cached drink gets the portions left there.
+
+        :return: the number of portions granted
+        """
+        future = asyncio.get_event_loop().create_future()
+        self._takes.setdefault(drink, []).append((count, future))
+        if self._taker is None:
+            self._taker = asyncio.ensure_future(self._write_takes())
+        return await future
+
+    async def _write_takes(self):
+        # the takes issued while a transaction is written go together in the next one
+        try:
+            while self._takes:
+                takes, self._takes = self._takes, dict()
+                wanted = [(drink, sum(count for count, _ in waiting)) for drink, waiting in takes.items()]
+                try:
+                    results = await dbx.write(self._take, [(drink.id, count) for drink, count in wanted])
+                except Exception as e:
+                    for waiting in takes.values():
+                        for _, future in waiting:
+                            if not future.done():
+                                future.set_exception(e)
+                    continue
+                for (drink, count), (granted, left) in zip(wanted, results):
+                    if granted < count <= drink.portions_left:
+                        # another writer took them
+                        metrics.portion_conflicts.inc(value=count - granted)
+                    drink.portions_left = left
+                    for share, future in takes[drink]:
+                        share = min(share, granted)
+                        granted -= share
+                        if not future.done():
+                            future.set_result(share)
+        finally:
+            self._taker = None
+
+    @staticmethod
+    def _take(takes):
+        """
+        :return: (portions granted, portions left) for every (drink id, portions wanted)
+        """
+        results = []
+        for drink_id, granted in takes:
+            while granted > 0 and not Drink.update(portions_left=Drink.portions_left - granted).where(
+                    (Drink.id == drink_id) & (Drink.portions_left >= granted)).execute():
+                granted = min(granted, Drink.select(Drink.portions_left).where(Drink.id == drink_id).scalar() or 0)
+            results.append((max(granted, 0),
+                            Drink.select(Drink.portions_left).where(Drink.id == drink_id).scalar() or 0))
+        return results
+
+    async def restock(self, drink: Drink, due_before: int = None):
+        """
+        Restocks the drink in the database, only if it wasn't restocked since due_before when that's given.
+        The cached drink gets the values of the database row.
+        """
+        drink.portions_left, drink.restocked_at = await dbx.write(self._restock, drink.id, due_before,
+                                                                  int(time.time()))
+
+    @staticmethod
+    def _restock(drink_id, due_before, now):
+        query = Drink.update(portions_left=Drink.portions_per_day, restocked_at=now).where(Drink.id == drink_id)
+        if due_before is not None:
+            query = query.where(Drink.restocked_at < due_before)
+        query.execute()
+        row = Drink.select(Drink.portions_left, Drink.restocked_at).where(Drink.id == drink_id).tuples().first()
+        return row or (0, now)
+
+    def record_dose(self, person: Person, drink: Drink, now: int):
+        """
+        Records the portion of the drink given to the person, the cached person is already updated.
+        """
+        self.doses.setdefault(person, []).append((drink.intoxication, now))
+
+    def cached_drinks(self, server):
+        return [drink for (sid, _), drink in self.drinks.items() if sid == server.sid]
+
+    async def restock_due_drinks(self, server):
+        """
+        Lazily restocks every drink of the server that missed the last restock moment.
+        The database is checked once per restock moment.
+        """
+        now = int(time.time())
+        last_restock = server.last_restock(now)
+        if self.restock_checked.get(server.sid) == last_restock:
+            return
+        self.restock_checked[server.sid] = last_restock
+        await dbx.write((Drink.update(portions_left=Drink.portions_per_day, restocked_at=now)
+                         .where((Drink.server == server) & (Drink.restocked_at < last_restock))
+                         ).execute)
+        for drink in self.cached_drinks(server):
+            drink.restock_if_due(last_restock, now)
+
+    def forget_drink(self, server, name):
+        self.drinks.pop((server.sid, name), None)
+
+    def evict_server(self, server, persons=True):
+        """
+        Drops cached drinks (and persons) of the server without writing them.
+        Used when the rows are deleted from the database.
+        """
+        for drink in self.cached_drinks(server):
+            self.forget_drink(server, drink.name)
+        self.restock_checked.pop(server.sid, None)
+        if persons:
+            for key in [key for key in self.persons if key[0] == server.sid]:
+                self.doses.pop(self.persons.pop(key), None)
+
+    @staticmethod
+    def _write_doses(person_id, doses):
+        for intoxication, now in doses:
+            # the dose of give_portion after the decay of Person.current_intoxication: an overdrink resets it to 0
+            sober = intoxication if intoxication < 100 else 0
+            db.execute_sql(DOSE_SQL, (now, sober, now, 100 - intoxication, now, now, intoxication, sober, now,
+                                      person_id))
+
+    @classmethod
+    def _write(cls, doses):
+        for person_id, person_doses in doses:
+            cls._write_doses(person_id, person_doses)
+
+    async def flush(self):
+        if self._writing is not None and not self._writing.done():
+            await asyncio.wait([self._writing])
+        if self.doses:
+            doses, self.doses = self.doses, dict()
+            # stop cancels the flush loop, the write of the taken doses goes on and the next flush waits for it
+            self._writing = asyncio.ensure_future(self._write_changes(doses))
+            await asyncio.shield(self._writing)
+        self._evict(self.persons, self.doses)
+        self._evict(self.drinks, self._takes)
+
+    @staticmethod
+    def _evict(cache, pending):
+        excess = len(cache) - MAX_CACHED
+        if excess <= 0:
+            return
+        evicted = list(islice((key for key, entry in cache.items() if entry not in pending), excess))
+        for key in evicted:
+            del cache[key]
+        logger.debug("Evicted {0} cached entries".format(len(evicted)))
+
+    async def _write_changes(self, doses):
+        try:
+            await dbx.write(self._write, [(person.id, person_doses) for person, person_doses in doses.items()])
+        except Exception:
+            for person, person_doses in doses.items():
+                self.doses[person] = person_doses + self.doses.get(person, [])
+            raise
+        logger.debug("Flushed {0} persons".format(len(doses)))
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                with metrics.timed(metrics.job_seconds, "state_flush"):
+                    await self.flush()
+            except Exception:
+                logger.exception("Failed to flush the state")
+
+    def start(self, loop):
+        if self._flusher is None:
+            self._flusher = loop.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+
+engine = StateEngine()
@@ -0,0 +1,60 @@
+"""
+Copies the data of an SQLite database file into the database of DB_BACKEND.
+
+    python3 -m barcounter.transfer path/to/sqlite.db
+
+The source file is migrated to the current schema first, the target must have no servers yet.
+"""
+import argparse
+import logging
+import sys
+
+from peewee import SqliteDatabase, PostgresqlDatabase, chunked
+
+from barcounter import db, log
+from barcounter.dbentities import Server, Person, Drink, PendingServe, Joke
+from barcounter.migrations import migrate
+
+logger = log
+
+# in the foreign key order
+TABLES = [Server, Person, Drink, PendingServe, Joke]
+BATCH_SIZE = 500
+
+
+def transfer(source, target=db):
+    migrate(source)
+    migrate(target)
+    if Server.select().exists(target):
+        raise ValueError("Target database already has servers")
+    with target.atomic():
+        for model in TABLES:
+            rows = model.select().order_by(model.id).dicts().iterator(source)
+            copied = 0
+            for batch in chunked(rows, BATCH_SIZE):
+                model.insert_many(batch).execute(target)
+                copied += len(batch)
+            if isinstance(target, PostgresqlDatabase):
+                # explicit ids don't advance the sequence
+                table = model._meta.table_name
+                target.execute_sql("SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                                   "COALESCE((SELECT MAX(id) FROM {0}), 0) + 1, false)".format(table))
+            logger.info("Copied {0} rows of {1}".format(copied, model.__name__))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python3 -m barcounter.transfer",
+                                     description="Copies an SQLite database into the configured DB_BACKEND.")
+    parser.add_argument("source", help="path to the SQLite database file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    source = SqliteDatabase(args.source)
+    try:
+        transfer(source)
+    finally:
+        source.close()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Check of the database code against every DB_BACKEND, runs offline for the SQLite backends.
+
+    python3 -m benchmarks.backends --backend sqlite pooled_sqlite postgres
+
+Every backend runs in its own process: the schema is created and the last migration is applied again,
+an SQLite file is transferred into it, then the timestamps past 2**31, the unique server ids, the cascade
+deletes of a server, the portions and doses of the state engine and the joke store are checked.
+The SQLite backends use a fresh file in a temporary directory. postgres uses DB_POSTGRES of the config, which
+may be overridden with DYNACONF_DB_POSTGRES__host and the like, the database must have no tables, the tables
+of the check are dropped afterwards. It's skipped with the reason when psycopg2 or the server is unavailable.
+The process exits with 1 if a check fails.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKENDS = ["sqlite", "pooled_sqlite", "postgres"]
+# unix time past what a 32-bit integer column holds
+NOW = 2 ** 32
+SID = 1
+
+
+class Checks:
+    def __init__(self, backend):
+        self.backend = backend
+        self.failed = 0
+
+    def expect(self, name, condition, details=""):
+        if not condition:
+            self.failed += 1
+        print("{0:14} {1:40} {2}{3}".format(self.backend, name, "ok" if condition else "FAILED",
+                                            " " + details if details else ""))
+
+
+def check_migrations(checks):
+    from barcounter import migrations
+    from barcounter.dbentities import SchemaVersion
+
+    migrations.migrate()
+    SchemaVersion.update(version=len(migrations.MIGRATIONS) - 1).execute()
+    migrations.migrate()
+    checks.expect("migrations", SchemaVersion.get().version == len(migrations.MIGRATIONS))
+
+
+def check_transfer(checks, workdir):
+    from peewee import SqliteDatabase
+
+    from barcounter.dbentities import Server, Person, Drink
+    from barcounter.migrations import MODELS, migrate
+    from barcounter.transfer import transfer
+
+    source = SqliteDatabase(os.path.join(workdir, "source.db"))
+    with source.bind_ctx(MODELS):
+        migrate(source)
+        server = Server.create(sid=SID, lang="en_US")
+        Person.create(server=server, uid=1, intoxication=10, intoxication_updated=NOW)
+        Drink.create(server=server, name="Beer", intoxication=10, portion_size=500, portions_per_day=10,
+                     portions_left=10, restocked_at=NOW)
+    transfer(source)
+    source.close()
+    person = Person.get()
+    checks.expect("transfer", person.intoxication_updated == NOW and Drink.get().restocked_at == NOW and
+                  Person.create(server=person.server, uid=2, intoxication=0).id > person.id)
+
+
+def check_timestamps(checks):
+    from barcounter.dbentities import Person, Drink, PendingServe
+
+    Person.update(intoxication_updated=NOW + 1).execute()
+    Drink.update(restocked_at=NOW + 1).execute()
+    serve = PendingServe.create(message_id=1, channel_id=1, guild_id=SID, author_id=1, drink_name="Beer",
+                                expected="1", deadline=NOW + 1)
+    checks.expect("timestamps past 2**31", {Person.get().intoxication_updated, Drink.get().restocked_at,
+                                            PendingServe.get_by_id(serve.id).deadline} == {NOW + 1})
+
+
+def check_unique_sid(checks):
+    from peewee import IntegrityError
+
+    from barcounter import db
+    from barcounter.dbentities import Server
+
+    try:
+        with db.atomic():
+            Server.create(sid=SID, lang="en_US")
+        duplicated = True
+    except IntegrityError:
+        duplicated = False
+    checks.expect("unique server sid", not duplicated and Server.select().where(Server.sid == SID).count() == 1)
+
+
+def check_cascade(checks):
+    from barcounter.dbentities import Server, Person, Drink
+
+    server = Server.create(sid=SID + 1, lang="en_US")
+    Person.create(server=server, uid=1, intoxication=0)
+    Drink.create(server=server, name="Wine", intoxication=10, portion_size=100, portions_per_day=1, portions_left=1)
+    server.delete_instance()
+    checks.expect("cascade deletes", not any(model.select().where(model.server == server.id).exists()
+                                             for model in (Person, Drink)))
+
+
+async def check_engine(checks):
+    from barcounter.cogs.drinkcog import give_portion
+    from barcounter.dbentities import Server, Person, Drink
+    from barcounter.dbexecutor import dbx
+    from barcounter.state import engine
+
+    server = await dbx.read(Server.get, Server.sid == SID)
+    await dbx.write(Drink.update(intoxication=60, portions_left=3).execute)
+    drink = await engine.get_drink(server, "beer")
+    person = await engine.get_person(server, 3)
+    granted = [await engine.take_portions(drink, 2), await engine.take_portions(drink, 2)]
+    left = (await dbx.read(Drink.get_by_id, drink.id)).portions_left
+    checks.expect("take portions", granted == [2, 1] and left == drink.portions_left == 0,
+                  "granted {0}, {1} left".format(granted, left))
+
+    # a dose, an overdrink after the decay, a dose after the reset and one more after the decay
+    for now in (NOW, NOW + 1200, NOW + 1260, NOW + 3000):
+        give_portion(person, drink, now)
+    await engine.flush()
+    stored = await dbx.read(Person.get_by_id, person.id)
+    checks.expect("flushed doses", (stored.intoxication, stored.intoxication_updated) ==
+                  (person.intoxication, person.intoxication_updated),
+                  "{0} in the database, {1} cached".format(stored.intoxication, person.intoxication))
+
+
+def check_jokes(checks):
+    from barcounter.jokestore import JokeStore
+
+    store = JokeStore(3)
+    new = [store.add("en_US", ["a", "b", "a"]), store.add("en_US", ["b", "c"])]
+    checks.expect("joke store", new == [["a", "b"], ["c"]] and store.size("en_US") == 3 and
+                  sorted(store.sample("en_US", 5)) == ["a", "b", "c"])
+    # a full lang replaces a random joke
+    new = store.add("en_US", ["d"])
+    jokes = store.sample("en_US", 5)
+    checks.expect("full joke store", new == ["d"] and store.size("en_US") == JokeStore._count("en_US") == 3 and
+                  len(jokes) == 3 and "d" in jokes)
+
+
+def _run(backend, workdir):
+    """
+    :return: (failed checks, reason if the backend was skipped)
+    """
+    from peewee import ImproperlyConfigured, OperationalError
+
+    try:
+        from barcounter import db
+        from barcounter.dbexecutor import dbx
+        from barcounter.migrations import MODELS
+    except ImportError as e:
+        return 0, str(e)
+    checks = Checks(backend)
+    try:
+        db.connect()
+    except (ImproperlyConfigured, OperationalError) as e:
+        return 0, str(e).strip()
+    try:
+        tables = db.get_tables()
+        if tables:
+            checks.expect("empty database", False, "{0} has the tables {1}".format(db.database, ", ".join(tables)))
+            return checks.failed, None
+        try:
+            check_migrations(checks)
+            check_transfer(checks, workdir)
+            check_timestamps(checks)
+            check_unique_sid(checks)
+            check_cascade(checks)
+            asyncio.run(check_engine(checks))
+            check_jokes(checks)
+        finally:
+            dbx.shutdown()
+            if backend == "postgres":
+                db.drop_tables(MODELS)
+    finally:
+        db.close()
+    return checks.failed, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backend", nargs="+", default=BACKENDS, choices=BACKENDS)
+    args = parser.parse_args()
+
+    os.environ.setdefault("ROOT_PATH_FOR_DYNACONF", os.path.join(ROOT, "config"))
+    sys.path.insert(0, ROOT)
+    failed = 0
+    context = multiprocessing.get_context("spawn")
+    for backend in args.backend:
+        workdir = tempfile.mkdtemp(prefix="barcounter-backends-")
+        # the database is built from the settings on import, so every backend gets a fresh process
+        os.environ["DYNACONF_DB_BACKEND"] = backend
+        os.environ["DYNACONF_DB_LOCATION"] = os.path.join(workdir, "sqlite.db")
+        os.environ["DYNACONF_LOGS_LOCATION"] = workdir
+        with context.Pool(1) as pool:
+            backend_failed, skipped = pool.apply(_run, (backend, workdir))
+        if skipped:
+            print("{0:14} skipped: {1}".format(backend, skipped))
+        failed += backend_failed
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
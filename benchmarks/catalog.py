@@ -0,0 +1,81 @@
+"""
+Micro-benchmark of confutils.lang against the lookup it replaced, a walk of the dynaconf settings per call.
+
+    python3 -m benchmarks.catalog --calls 20000
+
+Both lookups are checked to give the same strings first, the process exits with 1 if they don't.
+The config of the repository is used.
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+from collections.abc import Iterable
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# lang, path, what is looked up
+CASES = [
+    ("en_US", ("drink_not_found",), "string"),
+    ("ru_RU", ("no_portions_left",), "variants"),
+    ("ru_RU", ("missing_permissions", "drink"), "en_US fallback"),
+    ("ru_RU", ("missing_permissions", "serve"), "nested string"),
+]
+
+
+def dynaconf_lang(lang_code, *path, fail_to_en_us=True):
+    """
+    confutils.lang before the catalog.
+    """
+    from dynaconf import settings
+
+    package = settings.LANG[lang_code]
+    for p in path:
+        if p not in package and lang_code != "en_US" and fail_to_en_us:
+            return dynaconf_lang("en_US", *path)
+        package = package[p]
+    if isinstance(package, Iterable) and not isinstance(package, str):
+        return random.choice(list(package))
+    return package
+
+
+def check():
+    from barcounter import confutils as conf
+
+    failed = 0
+    for lang_code, path, _ in CASES:
+        new = set(conf.lang_all(lang_code, *path))
+        old = {dynaconf_lang(lang_code, *path) for _ in range(50 * len(new))}
+        if old != new:
+            failed += 1
+            print("{0} {1}: {2!r} != {3!r}".format(lang_code, ".".join(path), sorted(new), sorted(old)))
+    return failed == 0
+
+
+def bench(calls):
+    from barcounter import confutils as conf
+
+    print("{0:50} {1:>12} {2:>11}".format("lookup", "dynaconf us", "catalog us"))
+    for lang_code, path, kind in CASES:
+        times = []
+        for lookup in (dynaconf_lang, conf.lang):
+            # best of 5 runs, per call
+            times.append(min(timeit.repeat(lambda: lookup(lang_code, *path), number=calls, repeat=5)) / calls)
+        print("{0:50} {1:12.2f} {2:11.2f}".format("{0} {1} ({2})".format(lang_code, ".".join(path), kind),
+                                                  times[0] * 1000000, times[1] * 1000000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=20000, help="calls per run")
+    args = parser.parse_args()
+
+    os.environ.setdefault("ROOT_PATH_FOR_DYNACONF", os.path.join(ROOT, "config"))
+    sys.path.insert(0, ROOT)
+    if not check():
+        sys.exit(1)
+    bench(args.calls)
+
+
+if __name__ == "__main__":
+    main()
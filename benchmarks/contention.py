@@ -0,0 +1,203 @@
+"""
+Stress test of concurrent consumption of one drink by several bot processes sharing a database, runs offline.
+
+    python3 -m benchmarks.contention --workers 2 --takes 2000 --strategy engine lock atomic
+
+Every worker process takes --takes portions of the same drink for random persons, at most --concurrency at once.
+The drink has fewer portions than all the workers take together, so the last portions are contested.
+Strategies:
+
+* engine: take_portion of the state engine of the process, the doses are flushed every --flush seconds
+* lock: the pre-engine read-modify-write of both rows, under an exclusive database lock
+* atomic: a conditional UPDATE of both rows per take, no cache
+
+After the run no portion may be sold twice or lost: no more takes are granted than the drink had portions,
+the portions taken from the drink are the takes granted and the intoxication of the persons sums up
+to the doses given (every drink is 1% and no time passes for the decay).
+By default a fresh SQLite file in a temporary directory and the config of the repository are used.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SID = 1
+DRINK = "contended"
+# fixed time of the takes, the intoxication doesn't decay
+NOW = 2000000000
+
+
+async def _take_engine(server, uid):
+    from barcounter.cogs.drinkcog import take_portion
+    from barcounter.state import engine
+
+    person = await engine.get_person(server, uid)
+    drink = await engine.get_drink(server, DRINK)
+    return await take_portion(person, drink, NOW) is not None
+
+
+def _take_locked(server, drink_name, uid):
+    from barcounter import db
+    from barcounter.dbentities import Drink, Person
+
+    with db.atomic("IMMEDIATE"):
+        person = Person.get_or_create(server=server, uid=uid, defaults={"intoxication": 0})[0]
+        drink = Drink.get((Drink.server == server) & (Drink.name == drink_name))
+        if drink.portions_left <= 0:
+            return False
+        drink.portions_left -= 1
+        drink.save()
+        person.set_intoxication(person.current_intoxication(NOW) + drink.intoxication, NOW)
+        person.save()
+        return True
+
+
+def _take_atomic(server, drink_id, uid):
+    from barcounter.state import StateEngine
+
+    granted, _ = StateEngine._take([(drink_id, 1)])[0]
+    if not granted:
+        return False
+    person_id = StateEngine._load_persons(server, [uid])[0].id
+    StateEngine._write_doses(person_id, [(1, NOW)])
+    return True
+
+
+async def _work(strategy, seed, takes, concurrency, persons, flush):
+    from barcounter.dbentities import Drink, Server
+    from barcounter.dbexecutor import dbx
+    from barcounter.state import engine
+
+    server = await dbx.read(Server.get, Server.sid == SID)
+    drink_id = (await dbx.read(Drink.get, (Drink.server == server) & (Drink.name == DRINK))).id
+    rng = random.Random(seed)
+    semaphore = asyncio.Semaphore(concurrency)
+    granted = 0
+
+    async def take():
+        nonlocal granted
+        uid = rng.randrange(persons)
+        async with semaphore:
+            if strategy == "engine":
+                taken = await _take_engine(server, uid)
+            elif strategy == "lock":
+                taken = await dbx.read(_take_locked, server, DRINK, uid)
+            else:
+                taken = await dbx.write(_take_atomic, server, drink_id, uid)
+        granted += taken
+
+    async def flush_loop():
+        while True:
+            await asyncio.sleep(flush)
+            await engine.flush()
+
+    flusher = asyncio.ensure_future(flush_loop()) if strategy == "engine" else None
+    started = time.perf_counter()
+    await asyncio.gather(*(take() for _ in range(takes)))
+    if flusher is not None:
+        flusher.cancel()
+        await engine.flush()
+    return granted, time.perf_counter() - started
+
+
+def _worker(strategy, seed, takes, concurrency, persons, flush):
+    from barcounter import metrics
+    from barcounter.dbexecutor import dbx
+
+    try:
+        granted, elapsed = asyncio.run(_work(strategy, seed, takes, concurrency, persons, flush))
+    finally:
+        dbx.shutdown()
+    conflicts = getattr(metrics, "portion_conflicts", None)
+    return granted, elapsed, sum(conflicts.values.values()) if conflicts is not None else 0
+
+
+def _seed(portions):
+    from barcounter.dbentities import Drink, Person, Server
+
+    Person.delete().execute()
+    Drink.delete().execute()
+    Server.delete().execute()
+    server = Server.create(sid=SID, lang="en_US")
+    Drink.create(server=server, name=DRINK, name_key=DRINK, intoxication=1, portion_size=100,
+                 portions_per_day=portions, portions_left=portions, restocked_at=int(time.time()))
+
+
+def _check():
+    from peewee import fn
+
+    from barcounter.dbentities import Drink, Person
+
+    left = Drink.get(Drink.name == DRINK).portions_left
+    doses = Person.select(fn.COALESCE(fn.SUM(Person.intoxication), 0)).scalar()
+    return left, doses
+
+
+def run(args, strategy):
+    from barcounter import db
+
+    with db.connection_context():
+        _seed(args.portions)
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(args.workers) as pool:
+        results = pool.starmap(_worker, [(strategy, args.seed + n, args.takes, args.concurrency, args.persons,
+                                          args.flush) for n in range(args.workers)])
+    with db.connection_context():
+        left, doses = _check()
+    granted = sum(result[0] for result in results)
+    elapsed = max(result[1] for result in results)
+    conflicts = sum(result[2] for result in results)
+    taken = args.portions - left
+    if granted > args.portions:
+        check = "OVERSOLD {0} portions".format(granted - args.portions)
+    elif taken != granted or doses != granted:
+        check = "LOST {0} portions, {1} doses".format(granted - taken, granted - doses)
+    else:
+        check = "ok"
+    print("{0:8} {1:>9.1f} {2:>8} {3:>8} {4:>6} {5:>9} {6}".format(
+        strategy, args.workers * args.takes / elapsed, granted, taken, left, conflicts, check))
+    return check == "ok"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2, help="bot processes")
+    parser.add_argument("--takes", type=int, default=2000, help="portions taken by every worker")
+    parser.add_argument("--portions", type=int, help="portions of the drink, 3/4 of all the takes by default")
+    parser.add_argument("--persons", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=100, help="takes in flight per worker")
+    parser.add_argument("--flush", type=float, default=0.05, help="flush interval of the engine")
+    parser.add_argument("--strategy", nargs="+", default=["engine", "lock", "atomic"],
+                        choices=["engine", "lock", "atomic"])
+    parser.add_argument("--db", help="SQLite file to use instead of a temporary one")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.portions is None:
+        args.portions = args.workers * args.takes * 3 // 4
+    if args.workers * args.takes // args.persons >= 100:
+        parser.error("a person would overdrink, raise --persons")
+
+    workdir = tempfile.mkdtemp(prefix="barcounter-contention-")
+    os.environ.setdefault("ROOT_PATH_FOR_DYNACONF", os.path.join(ROOT, "config"))
+    os.environ["DYNACONF_DB_BACKEND"] = "sqlite"
+    os.environ["DYNACONF_DB_LOCATION"] = args.db or os.path.join(workdir, "sqlite.db")
+    os.environ["DYNACONF_LOGS_LOCATION"] = workdir
+    sys.path.insert(0, ROOT)
+    from barcounter import db, migrations
+
+    with db.connection_context():
+        migrations.migrate()
+    print("database: {0}".format(os.environ["DYNACONF_DB_LOCATION"]), file=sys.stderr)
+    print("{0:8} {1:>9} {2:>8} {3:>8} {4:>6} {5:>9} {6}".format(
+        "strategy", "takes/s", "granted", "taken", "left", "conflicts", "check"))
+    ok = all([run(args, strategy) for strategy in args.strategy])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
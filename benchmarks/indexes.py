@@ -0,0 +1,135 @@
+"""
+Benchmark of the lookups by Server.sid, Person(server, uid) and Drink(server, name) before and after
+the migration adding their unique indexes, runs offline.
+
+    python3 -m benchmarks.indexes --guilds 10000 --persons 100 --drinks 10
+
+A database of the current schema is seeded, then the indexes are dropped to get the schema before the migration,
+the lookups are measured, the migration is applied and the lookups are measured again.
+Every lookup is measured through peewee, as the bot does it, and as its SQL alone.
+The indexes of the foreign keys stay, so the persons and the drinks are found among the rows of their guild
+before the migration as well.
+By default a fresh SQLite file in a temporary directory and the config of the repository are used.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INSERT_BATCH = 1000
+# (table, columns) of the indexes added by the migration
+INDEXES = [("server", ["sid"]), ("person", ["server_id", "uid"]), ("drink", ["server_id", "name"])]
+
+
+def _insert(model, fields, rows):
+    from peewee import chunked
+
+    from barcounter import db
+
+    with db.atomic():
+        for batch in chunked(rows, INSERT_BATCH):
+            model.insert_many(batch, fields=fields).execute()
+
+
+def seed(guilds, persons, drinks):
+    from barcounter.dbentities import Server, Person, Drink
+
+    started = time.perf_counter()
+    _insert(Server, [Server.sid, Server.lang], ((sid, "en_US") for sid in range(guilds)))
+    ids = [server_id for server_id, in Server.select(Server.id).tuples()]
+    _insert(Person, [Person.server, Person.uid, Person.intoxication],
+            ((server_id, uid, 0) for server_id in ids for uid in range(persons)))
+    _insert(Drink, [Drink.server, Drink.name, Drink.name_key, Drink.intoxication, Drink.portion_size,
+                    Drink.portions_per_day, Drink.portions_left],
+            ((server_id, "drink {0}".format(n), "drink {0}".format(n), 10, 100, 10, 10)
+             for server_id in ids for n in range(drinks)))
+    print("seeded {0} guilds, {1} persons, {2} drinks in {3:.1f}s".format(
+        guilds, guilds * persons, guilds * drinks, time.perf_counter() - started), file=sys.stderr)
+    return ids
+
+
+def drop_indexes():
+    from barcounter import db
+
+    for table, columns in INDEXES:
+        for index in db.get_indexes(table):
+            if index.columns == columns:
+                db.execute_sql('DROP INDEX "{0}"'.format(index.name))
+
+
+def _measure(lookups, lookup):
+    started = time.perf_counter()
+    for args in lookups:
+        lookup(*args)
+    return (time.perf_counter() - started) / len(lookups) * 1000000
+
+
+def measure(ids, guilds, persons, drinks, count, rng):
+    """
+    :return: [(name, us per lookup with peewee, us per lookup of the SQL alone)] of every kind of lookup
+    """
+    from barcounter import db
+    from barcounter.dbentities import Server, Person, Drink
+
+    kinds = [
+        ("server by sid", lambda sid: Server.select().where(Server.sid == sid),
+         [(rng.randrange(guilds),) for _ in range(count)]),
+        ("person by (server, uid)",
+         lambda server_id, uid: Person.select().where((Person.server == server_id) & (Person.uid == uid)),
+         [(rng.choice(ids), rng.randrange(persons)) for _ in range(count)]),
+        ("drink by (server, name)",
+         lambda server_id, name: Drink.select().where((Drink.server == server_id) & (Drink.name == name)),
+         [(rng.choice(ids), "drink {0}".format(rng.randrange(drinks))) for _ in range(count)]),
+    ]
+    results = []
+    for name, query, lookups in kinds:
+        # the parameters of the compiled SQL are the arguments of the lookup in their order
+        sql, _ = query(*lookups[0]).sql()
+        results.append((name, _measure(lookups, lambda *args: query(*args).get()),
+                        _measure(lookups, lambda *args: db.execute_sql(sql, args).fetchone())))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=10000)
+    parser.add_argument("--persons", type=int, default=100, help="persons per guild")
+    parser.add_argument("--drinks", type=int, default=10, help="drinks per guild")
+    parser.add_argument("--lookups", type=int, default=2000, help="lookups per kind")
+    parser.add_argument("--db", help="SQLite file to use instead of a temporary one")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="barcounter-indexes-")
+    os.environ.setdefault("ROOT_PATH_FOR_DYNACONF", os.path.join(ROOT, "config"))
+    os.environ["DYNACONF_DB_BACKEND"] = "sqlite"
+    os.environ["DYNACONF_DB_LOCATION"] = args.db or os.path.join(workdir, "sqlite.db")
+    os.environ["DYNACONF_LOGS_LOCATION"] = workdir
+    sys.path.insert(0, ROOT)
+    from playhouse.migrate import SqliteMigrator
+
+    from barcounter import db, migrations
+
+    print("database: {0}".format(os.environ["DYNACONF_DB_LOCATION"]), file=sys.stderr)
+    rng = random.Random(args.seed)
+    with db.connection_context():
+        migrations.migrate()
+        ids = seed(args.guilds, args.persons, args.drinks)
+        drop_indexes()
+        before = measure(ids, args.guilds, args.persons, args.drinks, args.lookups, rng)
+        started = time.perf_counter()
+        with db.atomic():
+            migrations._add_unique_indexes(SqliteMigrator(db))
+        print("migration: {0:.1f}s".format(time.perf_counter() - started))
+        after = measure(ids, args.guilds, args.persons, args.drinks, args.lookups, rng)
+    print("{0:24} {1:>16} {2:>16} {3:>14} {4:>14}".format("lookup", "before peewee us", "after peewee us",
+                                                          "before SQL us", "after SQL us"))
+    for (name, old, old_sql), (_, new, new_sql) in zip(before, after):
+        print("{0:24} {1:16.1f} {2:16.1f} {3:14.1f} {4:14.1f}".format(name, old, new, old_sql, new_sql))
+
+
+if __name__ == "__main__":
+    main()
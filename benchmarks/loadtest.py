@@ -0,0 +1,338 @@
+"""
+Load test of the real cogs through fake guilds, members and a stand-in gateway, runs offline.
+
+    python3 -m benchmarks.loadtest --guilds 1000 --members 10 --rounds 3
+
+Every phase issues one command type in every guild with at most --concurrency commands in flight,
+then reports the throughput, p50/p99 latency, database queries (the state flush included) and messages sent
+per command.
+The event loop lag is sampled during the whole run. The commands are invoked through their callbacks,
+so argument parsing and checks are not measured.
+By default the bot uses a fresh SQLite file in a temporary directory and the config of the repository.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class QueryCounter:
+    """
+    Counts the SQL statements executed by the database, from every thread.
+    """
+
+    def __init__(self, db):
+        self.count = 0
+        self._lock = threading.Lock()
+        execute_sql = db.execute_sql
+
+        def counting(*args, **kwargs):
+            with self._lock:
+                self.count += 1
+            return execute_sql(*args, **kwargs)
+
+        db.execute_sql = counting
+
+
+class LoopLagMonitor:
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - expected))
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        self._task.cancel()
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, channel, content):
+        self.id = next(self._ids)
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+        self.reactions = []
+        self.mentions = []
+
+    async def add_reaction(self, emoji):
+        self.reactions.append(emoji)
+        self.channel.gateway.on_bot_reaction(self)
+
+    async def delete(self):
+        pass
+
+
+class FakeChannel:
+    # messages sent to all the channels
+    total_sent = 0
+
+    def __init__(self, gateway, guild, channel_id):
+        self.gateway = gateway
+        self.guild = guild
+        self.id = channel_id
+        self.sent = 0
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+        FakeChannel.total_sent += 1
+        return FakeMessage(self, content)
+
+    async def fetch_message(self, message_id):
+        return FakeMessage(self, None)
+
+    def typing(self):
+        return FakeTyping()
+
+
+class FakeTyping:
+    async def __aenter__(self):
+        pass
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeMember:
+    def __init__(self, guild, member_id, name):
+        self.guild = guild
+        self.id = member_id
+        self.display_name = name
+        self.mention = "<@{0}>".format(member_id)
+        self.roles = []
+        self.bot = False
+
+    async def move_to(self, channel, reason=None):
+        pass
+
+
+class FakeGuild:
+    def __init__(self, gateway, guild_id, locale, members):
+        self.id = guild_id
+        self.preferred_locale = locale
+        self.roles = []
+        self.system_channel = None
+        self.channel = FakeChannel(gateway, self, guild_id + 1)
+        self.members = {guild_id + 2 + n: None for n in range(members)}
+        for member_id in self.members:
+            self.members[member_id] = FakeMember(self, member_id, "member{0}".format(member_id))
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+    def get_channel(self, channel_id):
+        return self.channel if channel_id == self.channel.id else None
+
+
+class FakeContext:
+    def __init__(self, bot, guild, author):
+        self.bot = bot
+        self.guild = guild
+        self.author = author
+        self.channel = guild.channel
+        self.message = FakeMessage(guild.channel, "")
+
+    async def send(self, *args, **kwargs):
+        return await self.channel.send(*args, **kwargs)
+
+    def typing(self):
+        return FakeTyping()
+
+
+class FakeGateway:
+    """
+    Stands for the Discord gateway: creates the guilds, invokes the commands
+    and answers the serves with reaction events, as the served members would.
+    """
+
+    def __init__(self, bot, guilds, members, ru_share):
+        self.bot = bot
+        self.guilds = []
+        self._serves = dict()
+        for n in range(guilds):
+            locale = "ru-RU" if random.random() < ru_share else "en-US"
+            # snowflake-like ids spread over the shards
+            self.guilds.append(FakeGuild(self, (n + 1) << 32, locale, members))
+
+    async def invoke(self, guild, author, name, *args, **kwargs):
+        command = self.bot.get_command(name)
+        ctx = FakeContext(self.bot, guild, author)
+        started = time.perf_counter()
+        await command.callback(command.cog, ctx, *args, **kwargs)
+        return time.perf_counter() - started
+
+    async def serve(self, guild, author, drink_name, members):
+        self._serves[guild.channel.id] = [member.id for member in members]
+        return await self.invoke(guild, author, "serve", drink_name, members)
+
+    def on_bot_reaction(self, message):
+        # both answer emojis are on the serve message
+        targets = self._serves.get(message.channel.id)
+        if targets is not None and len(message.reactions) == 2:
+            del self._serves[message.channel.id]
+            ok_emoji = message.reactions[0]
+            for uid in targets:
+                payload = SimpleNamespace(message_id=message.id, user_id=uid, emoji=ok_emoji,
+                                          guild_id=message.guild.id, channel_id=message.channel.id)
+                self.bot.loop.call_soon(self.bot.dispatch, "raw_reaction_add", payload)
+
+
+class LoadTest:
+    def __init__(self, args):
+        from discord.ext import commands
+
+        from barcounter import confutils as conf, db
+        from barcounter.jokesources import registry
+        from barcounter.outbox import outbox
+        from barcounter.state import engine
+
+        self.args = args
+        self.conf = conf
+        self.engine = engine
+        self.outbox = outbox
+        self.queries = QueryCounter(db)
+        self.lag = LoopLagMonitor()
+        self.results = []
+        for providers in registry.providers.values():
+            for provider in providers:
+                provider.available = lambda: True
+                provider._fetch = self._stub_jokes
+        self.bot = commands.Bot(command_prefix="?")
+        for extension in ("drinkcog", "roleregistrarcog", "settingscog"):
+            self.bot.load_extension("barcounter.cogs." + extension)
+        self.gateway = FakeGateway(self.bot, args.guilds, args.members, args.ru_share)
+
+    @staticmethod
+    async def _stub_jokes():
+        return ["Stub joke #{0}".format(n) for n in range(10)]
+
+    def _default_drink(self, guild):
+        lang = "ru_RU" if guild.preferred_locale == "ru-RU" else "en_US"
+        return random.choice(self.conf.lang_all(lang, "default_drinks"))["name"]
+
+    async def _phase(self, name, make_command):
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        latencies = []
+
+        async def run(guild):
+            async with semaphore:
+                latencies.append(await make_command(guild))
+
+        queries = self.queries.count
+        sent = FakeChannel.total_sent
+        started = time.perf_counter()
+        await asyncio.gather(*(run(guild) for guild in self.gateway.guilds))
+        await self.outbox.flush()
+        await self.engine.flush()
+        elapsed = time.perf_counter() - started
+        self.results.append((name, len(latencies), elapsed, latencies, self.queries.count - queries,
+                             FakeChannel.total_sent - sent))
+
+    def _members(self, guild, count):
+        return random.sample(list(guild.members.values()), min(count, len(guild.members)))
+
+    async def run(self):
+        from barcounter.cogs.helpers import add_default_drinks
+
+        self.lag.start()
+        await self._phase("setup", self._timed(add_default_drinks))
+        for round_number in range(self.args.rounds):
+            await self._phase("drink", lambda guild: self.gateway.invoke(
+                guild, self._members(guild, 1)[0], "drink", drink_name=self._default_drink(guild)))
+            await self._phase("list", lambda guild: self.gateway.invoke(guild, self._members(guild, 1)[0], "list"))
+            await self._phase("add", lambda guild: self.gateway.invoke(
+                guild, self._members(guild, 1)[0], "add", "loadtest {0}".format(round_number)))
+            await self._phase("serve", lambda guild: self.gateway.serve(
+                guild, self._members(guild, 1)[0], self._default_drink(guild),
+                self._members(guild, self.args.serve_targets)))
+        self.lag.stop()
+        await self.engine.stop()
+
+    @staticmethod
+    def _timed(coro):
+        async def timed(guild):
+            started = time.perf_counter()
+            await coro(guild)
+            return time.perf_counter() - started
+
+        return timed
+
+    def report(self):
+        print("{0:8} {1:>8} {2:>10} {3:>9} {4:>9} {5:>9} {6:>11} {7:>9}".format(
+            "phase", "commands", "cmd/s", "p50 ms", "p99 ms", "max ms", "queries/cmd", "sends/cmd"))
+        by_phase = dict()
+        for name, count, elapsed, latencies, queries, sent in self.results:
+            total = by_phase.setdefault(name, [0, 0.0, [], 0, 0])
+            total[0] += count
+            total[1] += elapsed
+            total[2].extend(latencies)
+            total[3] += queries
+            total[4] += sent
+        for name, (count, elapsed, latencies, queries, sent) in by_phase.items():
+            print("{0:8} {1:8} {2:10.1f} {3:9.2f} {4:9.2f} {5:9.2f} {6:11.2f} {7:9.2f}".format(
+                name, count, count / elapsed, _percentile(latencies, 0.5) * 1000,
+                _percentile(latencies, 0.99) * 1000, max(latencies) * 1000, queries / count, sent / count))
+        lags = self.lag.lags
+        print("loop lag: p50 {0:.2f} ms, p99 {1:.2f} ms, max {2:.2f} ms, mean {3:.2f} ms over {4} samples".format(
+            _percentile(lags, 0.5) * 1000, _percentile(lags, 0.99) * 1000, max(lags, default=0) * 1000,
+            statistics.mean(lags) * 1000 if lags else 0, len(lags)))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python3 -m benchmarks.loadtest",
+                                     description="Drives the cogs through a simulated gateway and fake guilds.")
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--members", type=int, default=10, help="members per guild")
+    parser.add_argument("--rounds", type=int, default=3, help="times every command phase is repeated")
+    parser.add_argument("--concurrency", type=int, default=100, help="commands in flight")
+    parser.add_argument("--serve-targets", type=int, default=3, help="members served by one ?serve")
+    parser.add_argument("--ru-share", type=float, default=0.5, help="share of the ru_RU guilds")
+    parser.add_argument("--db", help="SQLite file to use instead of a temporary one")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    # the settings are read on the first import of barcounter
+    os.environ.setdefault("ROOT_PATH_FOR_DYNACONF", os.path.join(ROOT, "config"))
+    workdir = tempfile.mkdtemp(prefix="barcounter-loadtest-")
+    os.environ["DYNACONF_DB_LOCATION"] = args.db or os.path.join(workdir, "sqlite.db")
+    os.environ["DYNACONF_LOGS_LOCATION"] = workdir
+
+    from barcounter import db, migrations
+
+    with db.connection_context():
+        migrations.migrate()
+    test = LoadTest(args)
+    test.bot.loop.run_until_complete(test.run())
+    test.report()
+    print("database: {0}".format(os.environ["DYNACONF_DB_LOCATION"]), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
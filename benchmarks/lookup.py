@@ -0,0 +1,170 @@
+"""
+Regression check and benchmark of the drink resolver, StateEngine._resolve_drink, runs offline.
+
+    python3 -m benchmarks.lookup --guilds 2000 --drinks 1024
+
+First a few guilds with the same drink names check that the resolver stays in the guild and finds
+the exact name, then a case-insensitive match, then an unambiguous prefix, and that the exact lookup of ?remove
+takes no prefix. The process exits with 1 on a mismatch.
+Then --guilds guilds of --drinks drinks each are seeded and the latency of the resolver is measured
+against the lookup it replaced, a query by name only.
+By default a fresh SQLite file in a temporary directory and the config of the repository are used.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INSERT_BATCH = 1000
+
+# guild -> its drinks, the names repeat across the guilds
+CHECK_GUILDS = {
+    1: ["Beer", "beer", "Whiskey", "Wine", "Cider"],
+    2: ["Beer", "Vodka"],
+}
+# guild, name asked, name resolved or None if there's no such drink
+CHECKS = [
+    (1, "Beer", "Beer"),
+    (1, "beer", "beer"),
+    (1, "Cider", "Cider"),
+    (1, "CIDER", "Cider"),
+    (1, "wh", "Whiskey"),
+    (1, "w", None),
+    (1, "Vodka", None),
+    (2, "BEER", "Beer"),
+    (2, "vod", "Vodka"),
+    (2, "Cider", None),
+    (2, "Beers", None),
+]
+# the same for the exact lookup of ?remove, no prefixes
+EXACT_CHECKS = [
+    (1, "beer", "beer"),
+    (1, "CIDER", "Cider"),
+    (1, "wh", None),
+    (2, "vod", None),
+]
+
+
+def _drink(server, name):
+    from barcounter.dbentities import drink_key
+
+    return {"server": server, "name": name, "name_key": drink_key(name), "intoxication": 10, "portion_size": 100,
+            "portions_per_day": 10, "portions_left": 10}
+
+
+def _insert(rows):
+    from peewee import chunked
+
+    from barcounter import db
+    from barcounter.dbentities import Drink
+
+    with db.atomic():
+        for batch in chunked(rows, INSERT_BATCH):
+            Drink.insert_many(batch).execute()
+
+
+def check():
+    from barcounter.dbentities import Server, DoesNotExist
+    from barcounter.state import StateEngine
+
+    servers = {sid: Server.create(sid=sid, lang="en_US") for sid in CHECK_GUILDS}
+    _insert([_drink(servers[sid], name) for sid, names in CHECK_GUILDS.items() for name in names])
+    cases = [(check, False) for check in CHECKS] + [(check, True) for check in EXACT_CHECKS]
+    failed = 0
+    for (sid, name, expected), exact in cases:
+        try:
+            drink = StateEngine._resolve_drink(servers[sid], name, exact)
+            found = drink.name if drink.server_id == servers[sid].id else "{0} of another guild".format(drink.name)
+        except DoesNotExist:
+            found = None
+        if found != expected:
+            failed += 1
+            print("guild {0}: {1!r}{2} resolved to {3!r}, expected {4!r}".format(
+                sid, name, " (exact)" if exact else "", found, expected))
+    print("resolver checks: {0} of {1} passed".format(len(cases) - failed, len(cases)))
+    return failed == 0
+
+
+def _name(number):
+    return "Drink {0} special".format(number)
+
+
+def seed(guilds, drinks):
+    from barcounter.dbentities import Server
+
+    first = max(CHECK_GUILDS) + 1
+    Server.insert_many([{"sid": sid, "lang": "en_US"} for sid in range(first, first + guilds)]).execute()
+    servers = list(Server.select().where(Server.sid >= first))
+    started = time.perf_counter()
+    _insert([_drink(server, _name(number)) for server in servers for number in range(drinks)])
+    print("seeded {0} guilds x {1} drinks in {2:.1f}s".format(guilds, drinks, time.perf_counter() - started),
+          file=sys.stderr)
+    return servers
+
+
+def _measure(lookups, lookup):
+    from barcounter.dbentities import DoesNotExist
+
+    started = time.perf_counter()
+    for server, name in lookups:
+        try:
+            lookup(server, name)
+        except DoesNotExist:
+            pass
+    return (time.perf_counter() - started) / len(lookups) * 1000000
+
+
+def bench(servers, drinks, count, rng):
+    from barcounter.dbentities import Drink
+    from barcounter.state import StateEngine
+
+    def old(server, name):
+        # the server condition was lost to Python's and
+        return Drink.select().where(Drink.name == name).first()
+
+    numbers = [(rng.choice(servers), rng.randrange(drinks)) for _ in range(count)]
+    cases = [
+        ("exact", [(server, _name(number)) for server, number in numbers]),
+        ("case-insensitive", [(server, _name(number).upper()) for server, number in numbers]),
+        ("prefix", [(server, _name(number)[:-3].lower()) for server, number in numbers]),
+        ("miss", [(server, "no such drink {0}".format(number)) for server, number in numbers]),
+    ]
+    print("{0:18} {1:>12} {2:>14}".format("lookup", "resolver us", "by name us"))
+    for name, lookups in cases:
+        # by name only, anything but the exact name scans the whole table, a few lookups are enough
+        old_lookups = lookups if name == "exact" else lookups[:max(1, count // 100)]
+        print("{0:18} {1:12.1f} {2:14.1f}".format(name, _measure(lookups, StateEngine._resolve_drink),
+                                                  _measure(old_lookups, old)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=2000)
+    parser.add_argument("--drinks", type=int, default=1024, help="drinks per guild")
+    parser.add_argument("--lookups", type=int, default=2000, help="lookups per case")
+    parser.add_argument("--db", help="SQLite file to use instead of a temporary one")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="barcounter-lookup-")
+    os.environ.setdefault("ROOT_PATH_FOR_DYNACONF", os.path.join(ROOT, "config"))
+    os.environ["DYNACONF_DB_BACKEND"] = "sqlite"
+    os.environ["DYNACONF_DB_LOCATION"] = args.db or os.path.join(workdir, "sqlite.db")
+    os.environ["DYNACONF_LOGS_LOCATION"] = workdir
+    sys.path.insert(0, ROOT)
+    from barcounter import db, migrations
+
+    print("database: {0}".format(os.environ["DYNACONF_DB_LOCATION"]), file=sys.stderr)
+    with db.connection_context():
+        migrations.migrate()
+        ok = check()
+        if ok and args.guilds > 0:
+            bench(seed(args.guilds, args.drinks), args.drinks, args.lookups, random.Random(args.seed))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
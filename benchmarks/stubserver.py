@@ -0,0 +1,155 @@
+"""
+Check of httpclient.fetch against a local stub HTTP server that can be slow or failing, runs offline.
+
+    python3 -m benchmarks.stubserver
+
+The stub answers on 127.0.0.1, every scenario is a path of it: ok answers right away, flaky fails a few times
+first, fail always answers 500 and slow answers after --delay seconds. The checks cover the retries,
+the read timeout and the circuit breaker opening, letting a probe through after breaker_reset (half-open)
+and opening again when the probe fails. The process exits with 1 if a check fails.
+The config of the repository is used, with a short backoff, breaker threshold and breaker reset.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BREAKER_THRESHOLD = 2
+BREAKER_RESET = 0.5
+READ_TIMEOUT = 0.2
+
+
+class StubServer:
+    def __init__(self, delay):
+        from aiohttp import web
+
+        self.delay = delay
+        # path -> requests received
+        self.hits = dict()
+        # path -> failures left before it answers
+        self.failing = dict()
+        self.app = web.Application()
+        self.app.router.add_get("/{scenario}", self.handle)
+        self.runner = None
+        self.port = None
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        path = request.match_info["scenario"]
+        self.hits[path] = self.hits.get(path, 0) + 1
+        if path.startswith("slow"):
+            await asyncio.sleep(self.delay)
+        if path.startswith("fail") or self.failing.get(path, 0) > 0:
+            self.failing[path] = self.failing.get(path, 0) - 1
+            return web.Response(status=500, text="stub failure")
+        return web.json_response({"setup": "Stub", "punchline": path})
+
+    async def start(self):
+        from aiohttp import web
+
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def source(self, path, **options):
+        return dict(name=path, url="http://127.0.0.1:{0}/{1}".format(self.port, path), **options)
+
+
+class Checks:
+    def __init__(self):
+        self.failed = 0
+
+    def expect(self, name, condition, details=""):
+        if not condition:
+            self.failed += 1
+        print("{0:48} {1}{2}".format(name, "ok" if condition else "FAILED", " " + details if details else ""))
+
+
+async def _fetch(source):
+    """
+    :return: (body or None if the source is unavailable, seconds taken)
+    """
+    from barcounter.httpclient import fetch, SourceUnavailable
+
+    started = time.perf_counter()
+    try:
+        body = await fetch(source, as_json=True)
+    except SourceUnavailable:
+        body = None
+    return body, time.perf_counter() - started
+
+
+async def run(delay):
+    from barcounter.httpclient import close, is_available
+
+    stub = StubServer(delay)
+    await stub.start()
+    checks = Checks()
+    try:
+        body, _ = await _fetch(stub.source("ok"))
+        checks.expect("answer", body == {"setup": "Stub", "punchline": "ok"} and stub.hits["ok"] == 1)
+
+        stub.failing["flaky"] = 2
+        body, _ = await _fetch(stub.source("flaky", retries=2))
+        checks.expect("retries until an answer", body is not None and stub.hits["flaky"] == 3,
+                      "{0} requests".format(stub.hits["flaky"]))
+
+        body, _ = await _fetch(stub.source("fail1", retries=2))
+        checks.expect("gives up after the retries", body is None and stub.hits["fail1"] == 3,
+                      "{0} requests".format(stub.hits["fail1"]))
+
+        body, elapsed = await _fetch(stub.source("slow", retries=1, read_timeout=READ_TIMEOUT))
+        checks.expect("read timeout", body is None and elapsed < delay,
+                      "{0:.2f}s with the server answering in {1}s".format(elapsed, delay))
+
+        source = stub.source("fail2", retries=0)
+        for _ in range(BREAKER_THRESHOLD):
+            await _fetch(source)
+        hits = stub.hits["fail2"]
+        body, elapsed = await _fetch(source)
+        checks.expect("open breaker skips the source", body is None and stub.hits["fail2"] == hits and
+                      not is_available("fail2"), "{0:.4f}s, no request".format(elapsed))
+
+        await asyncio.sleep(BREAKER_RESET)
+        checks.expect("half-open breaker allows a probe", is_available("fail2"))
+        await _fetch(source)
+        checks.expect("failed probe opens it again", stub.hits["fail2"] == hits + 1 and not is_available("fail2"))
+
+        stub.failing["flaky2"] = BREAKER_THRESHOLD
+        source = stub.source("flaky2", retries=0)
+        for _ in range(BREAKER_THRESHOLD):
+            await _fetch(source)
+        await asyncio.sleep(BREAKER_RESET)
+        body, _ = await _fetch(source)
+        await _fetch(source)
+        checks.expect("successful probe closes it", body is not None and is_available("flaky2") and
+                      stub.hits["flaky2"] == BREAKER_THRESHOLD + 2)
+    finally:
+        await close()
+        await stub.stop()
+    return checks.failed == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--delay", type=float, default=2, help="seconds the slow scenario takes to answer")
+    args = parser.parse_args()
+
+    os.environ.setdefault("ROOT_PATH_FOR_DYNACONF", os.path.join(ROOT, "config"))
+    os.environ["DYNACONF_HTTP__retry_backoff"] = "0.01"
+    os.environ["DYNACONF_HTTP__breaker_threshold"] = str(BREAKER_THRESHOLD)
+    os.environ["DYNACONF_HTTP__breaker_reset"] = str(BREAKER_RESET)
+    sys.path.insert(0, ROOT)
+    sys.exit(0 if asyncio.run(run(args.delay)) else 1)
+
+
+if __name__ == "__main__":
+    main()